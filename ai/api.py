@@ -1,33 +1,125 @@
-from model.dice_pos_model_inference import DicePosModelInference
-from model.dice_score_model_inference import DiceScoreModelInference
-from PIL import Image
-from fastapi import FastAPI, File, UploadFile
+from contextlib import asynccontextmanager
+from detector import Detector
+from model.backends import configure_threads, default_model_paths, import_backend
+from model.preprocess import decode_image
+from model.roi import RoiTracker
+from PIL import UnidentifiedImageError
+from serve.cache import DetectionCache
+from serve.executor import InferenceExecutor, QueueFullError
+from serve.metrics import InferenceMetrics, RequestTimingMiddleware, server_timing
+from serve.motion import MotionGate, motion_thumbnail
+from fastapi import (
+    FastAPI,
+    File,
+    HTTPException,
+    Request,
+    Response,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+import asyncio
+import config
+import logging
 import os
-import shutil
+import threading
+import time
+
+
+logger = logging.getLogger("uvicorn.error")
+
+# Filled in by `start` on a background thread, so that the liveness probe
+# answers while the models are still loading
+executor = None
+startup = {"state": "starting", "phases": {}, "error": None}
+
+
+def model_paths():
+    pos_path, score_path = default_model_paths(
+        config.BACKEND,
+        config.PRECISION,
+        single_stage=config.SINGLE_STAGE,
+        score_arch=config.SCORE_ARCH,
+        weights_format=config.WEIGHTS_FORMAT,
+    )
+    pos_path = config.DICE_POS_MODEL or pos_path
+    score_path = config.DICE_SCORE_MODEL or score_path
+    return [
+        path if path is None else os.path.join(config.BASE_DIR, path)
+        for path in (pos_path, score_path)
+    ]
+
+
+def build_detector():
+    phases = startup["phases"]
+    started_at = time.perf_counter()
+    detector = Detector(
+        *model_paths(),
+        backend=config.BACKEND,
+        single_stage=config.SINGLE_STAGE,
+        score_arch=config.SCORE_ARCH,
+        imgsz=config.POS_IMGSZ,
+        conf=config.POS_CONF,
+        fast_path_conf=config.FAST_PATH_CONF,
+    )
+    loaded_at = time.perf_counter()
+    detector.warmup(runs=config.WARMUP_RUNS)
+    warmed_at = time.perf_counter()
+
+    phases["load"] = phases.get("load", 0.0) + loaded_at - started_at
+    phases["warmup"] = phases.get("warmup", 0.0) + warmed_at - loaded_at
+    logger.info(
+        f"Detector ready: model load {loaded_at - started_at:.2f}s, "
+        f"warm-up {warmed_at - loaded_at:.2f}s ({config.WARMUP_RUNS} runs)"
+    )
+    return detector
+
 
+def start():
+    global executor
+    try:
+        started_at = time.perf_counter()
+        import_backend(config.BACKEND)
+        configure_threads(
+            config.BACKEND, config.INTRA_OP_THREADS, config.INTER_OP_THREADS
+        )
+        startup["phases"]["import"] = time.perf_counter() - started_at
+        logger.info(
+            f"Imported the {config.BACKEND} backend in "
+            f"{startup['phases']['import']:.2f}s"
+        )
 
-class Detector:
-    def __init__(self, dice_pos_model_path: str, dice_score_model_path: str):
-        self.dice_pos_model = DicePosModelInference(model_path=dice_pos_model_path)
-        self.dice_score_model = DiceScoreModelInference(
-            model_path=dice_score_model_path
+        executor = InferenceExecutor(
+            detector_factory=build_detector,
+            workers=config.WORKERS,
+            max_queue=config.MAX_QUEUE,
+            max_batch=config.BATCH_MAX,
+            max_wait=config.BATCH_WAIT_MS / 1000,
+        )
+        startup["phases"]["total"] = time.perf_counter() - started_at
+        startup["state"] = "ready"
+        logger.info(
+            f"AI service ready in {startup['phases']['total']:.2f}s "
+            f"({config.WORKERS} workers)"
         )
+    except Exception as e:
+        startup["state"] = "failed"
+        startup["error"] = str(e)
+        logger.exception("AI service failed to start")
 
-    def __call__(self, image_path):
-        bboxes = self.dice_pos_model(image_path=image_path)
-        img = Image.open(image_path).convert("RGB")
-        scores = []
-        for bbox in bboxes:
-            x, y, w, h = bbox
-            cropped = img.crop((x, y, x + w, y + h)).resize((32, 32))
-            score = self.dice_score_model(img=cropped)
-            scores.append(score)
 
-        return [[int(x.item()) for x in bbox] for bbox in bboxes], scores
+@asynccontextmanager
+async def lifespan(_):
+    threading.Thread(target=start, name="startup", daemon=True).start()
+    yield
+    if executor is not None:
+        executor.shutdown()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,25 +128,223 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestTimingMiddleware)
+
+cache = None
+if config.CACHE_SIZE > 0:
+    cache = DetectionCache(max_entries=config.CACHE_SIZE, ttl=config.CACHE_TTL)
+
+rois = None
+if config.ROI:
+    rois = RoiTracker(
+        margin=config.ROI_MARGIN,
+        history=config.ROI_HISTORY,
+        recheck_every=config.ROI_RECHECK_EVERY,
+        fixed=config.ROI_BOX,
+    )
+
+metrics = InferenceMetrics()
+
+
+async def run_detection(frame, timings, source="default"):
+    # Returns ((bboxes, scores), info), raises QueueFullError when saturated.
+    # `timings` receives the seconds of the cache lookup, the queue wait and
+    # every detector stage (shared by all frames of a micro-batch).
+    # `source` identifies the camera whose tray ROI is used and updated
+    key = None
+    if cache is not None:
+        started_at = time.perf_counter()
+        key, cached = await run_in_threadpool(cache.lookup, frame)
+        timings["cache"] = time.perf_counter() - started_at
+        if cached is not None:
+            return cached, {"cache": "hit", "queue_wait": None, "region": None}
+
+    roi = None if rois is None else rois.get(source)
+    region = None if roi is None else roi.region(frame.shape)
+    future = executor.submit(frame, region)
+    result, queue_wait, detector_timings = await asyncio.wrap_future(future)
+    timings["queue"] = queue_wait
+    timings.update(detector_timings)
+    if roi is not None:
+        roi.update(frame.shape, result[0], region)
+    if cache is not None:
+        cache.put(key, result)
+    return result, {
+        "cache": None if cache is None else "miss",
+        "queue_wait": queue_wait,
+        "region": region,
+    }
 
-detector = Detector(
-    dice_pos_model_path="output/dice-pos-model.pt",
-    dice_score_model_path="output/dice-score-model.pth",
-)
+
+def not_ready():
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Detector is not ready.", "state": startup["state"]},
+        headers={"Retry-After": "1"},
+    )
 
 
 @app.post("/detect")
-async def detect_image(file: UploadFile = File(...)):
-    var_dir = "var"
-    os.makedirs(var_dir, exist_ok=True)
-    file_path = os.path.join(var_dir, file.filename or "")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    bboxes, scores = detector(file_path)
+async def detect_image(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    debug: bool = False,
+    source: str = "default",
+):
+    # debug: also return the per-stage timings (in ms) and the ROI in the body
+    # source: camera id, every camera has its own tray ROI (AI_ROI=1)
+    if executor is None:
+        return not_ready()
+
+    # The body was received and parsed before the endpoint ran, see
+    # RequestTimingMiddleware; `file` is already spooled in memory or on disk
+    started_at = request.state.started_at
+    body_received_at = request.state.body_received_at
+    data = await file.read()
+    decode_started_at = time.perf_counter()
+    timings = {
+        "read": body_received_at - started_at,
+        "parse": decode_started_at - body_received_at,
+    }
+    try:
+        frame = await run_in_threadpool(decode_image, data)
+    except UnidentifiedImageError:
+        metrics.record(timings, outcome="bad_image")
+        raise HTTPException(status_code=400, detail="Cannot decode the uploaded image.")
+    timings["decode"] = time.perf_counter() - decode_started_at
+
+    try:
+        (bboxes, scores), info = await run_detection(frame, timings, source)
+    except QueueFullError as e:
+        metrics.record(timings, outcome="saturated")
+        return JSONResponse(
+            status_code=503,
+            content={
+                "detail": "Detector is saturated, retry later.",
+                "queue_depth": e.depth,
+                "max_queue": e.capacity,
+            },
+            headers={"Retry-After": "1"},
+        )
+
+    timings["total"] = time.perf_counter() - started_at
+    metrics.record(
+        timings, dice=len(bboxes), outcome="cached" if info["cache"] == "hit" else "ok"
+    )
+
+    if info["cache"] is not None:
+        response.headers["X-Cache"] = info["cache"]
+    if info["queue_wait"] is not None:
+        response.headers["X-Queue-Wait-Ms"] = f"{info['queue_wait'] * 1000:.1f}"
+        response.headers["X-Queue-Depth"] = str(executor.depth)
+    if config.SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(timings)
+    if debug:
+        return {
+            "bboxes": bboxes,
+            "scores": scores,
+            "timings": {stage: seconds * 1000 for stage, seconds in timings.items()},
+            "region": info["region"],
+        }
     return {"bboxes": bboxes, "scores": scores}
 
 
+@app.websocket("/detect_stream")
+async def detect_stream(websocket: WebSocket):
+    # The client streams encoded camera frames as binary messages. Every frame
+    # only costs a thumbnail diff; the detector runs once the dice have stopped
+    # moving and its result is pushed back as {"event": "result", ...}.
+    if executor is None:
+        # 1013: try again later
+        await websocket.close(code=1013)
+        return
+
+    await websocket.accept()
+    source = websocket.query_params.get("source", "default")
+    gate = MotionGate(
+        threshold=config.MOTION_THRESHOLD, settle_frames=config.MOTION_SETTLE_FRAMES
+    )
+    was_moving = False
+    try:
+        while True:
+            data = await websocket.receive_bytes()
+            try:
+                thumbnail = await run_in_threadpool(
+                    motion_thumbnail, data, config.MOTION_WIDTH
+                )
+            except UnidentifiedImageError:
+                await websocket.send_json(
+                    {"event": "error", "detail": "Cannot decode the frame."}
+                )
+                continue
+
+            moving, settled = gate.update(thumbnail)
+            if moving and not was_moving:
+                await websocket.send_json({"event": "moving"})
+            was_moving = moving
+            if not settled:
+                continue
+
+            started_at = time.perf_counter()
+            frame = await run_in_threadpool(decode_image, data)
+            timings = {"decode": time.perf_counter() - started_at}
+            try:
+                (bboxes, scores), info = await run_detection(frame, timings, source)
+            except QueueFullError as e:
+                metrics.record(timings, outcome="saturated")
+                gate.reset()
+                await websocket.send_json(
+                    {
+                        "event": "error",
+                        "detail": "Detector is saturated, retrying.",
+                        "queue_depth": e.depth,
+                        "max_queue": e.capacity,
+                    }
+                )
+                continue
+            timings["total"] = time.perf_counter() - started_at
+            metrics.record(
+                timings,
+                dice=len(bboxes),
+                outcome="cached" if info["cache"] == "hit" else "ok",
+            )
+            await websocket.send_json(
+                {"event": "result", "bboxes": bboxes, "scores": scores}
+            )
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process serves requests, fails only if startup failed
+    if startup["state"] == "failed":
+        return JSONResponse(status_code=500, content=startup)
+    return {"state": startup["state"]}
+
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: models are loaded and warmed up
+    if startup["state"] != "ready":
+        return JSONResponse(status_code=503, content=startup)
+    return startup
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
 if __name__ == "__main__":
     import uvicorn
 
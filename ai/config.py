@@ -0,0 +1,111 @@
+import json
+import os
+
+
+def _env(name, default, cast=str):
+    value = os.environ.get(name)
+    return default if value is None or value == "" else cast(value)
+
+
+def _bool(value):
+    return value.lower() in ("1", "true", "yes")
+
+
+# Folder of this file, relative model paths are resolved against it
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Settings tuned for this machine by `python -m utils.autotune` (e.g.
+# profiles/pi.json): they replace the defaults of the YOLO input size and
+# confidence, the workers, thread counts and batch size below, an AI_* variable
+# still wins over the profile
+PROFILE = _env("AI_PROFILE", "")
+_profile = {}
+if PROFILE:
+    with open(os.path.join(BASE_DIR, PROFILE)) as f:
+        _profile = json.load(f)["settings"]
+
+# Inference backend: "torch" (reference) or "onnx" (onnxruntime, CPU provider)
+BACKEND = _env("AI_BACKEND", "torch")
+# "fp32", or "int8" for the onnx models written by `python -m model.quantize`
+PRECISION = _env("AI_PRECISION", "fp32")
+# Single-stage mode: one 6-class YOLO returns boxes and scores, no classifier
+SINGLE_STAGE = _env("AI_SINGLE_STAGE", False, _bool)
+# Dice score model architecture: "base", or "tiny" (distilled, for Pi-class
+# CPUs, trained with `python -m model.dice_score_model_train --arch tiny`)
+SCORE_ARCH = _env("AI_SCORE_ARCH", "base")
+# Torch weights: "pickle" loads the .pt/.pth checkpoints, "safetensors" the
+# memory-mapped files written by `python -m model.export_weights` (nothing is
+# unpickled, faster start-up, the pages are shared between processes)
+WEIGHTS_FORMAT = _env("AI_WEIGHTS_FORMAT", "pickle")
+# Model files, empty picks the default of the backend/precision/mode above
+DICE_POS_MODEL = _env("AI_DICE_POS_MODEL", "")
+DICE_SCORE_MODEL = _env("AI_DICE_SCORE_MODEL", "")
+# YOLO input size (multiple of 32) and minimum confidence of a die box
+POS_IMGSZ = _env("AI_POS_IMGSZ", _profile.get("imgsz", 256), int)
+POS_CONF = _env("AI_POS_CONF", _profile.get("conf", 0.25), float)
+# Cascade (opt-in): the dice whose pips the classical counter of
+# model/pip_counter.py counts with at least this confidence (0-1) skip the dice
+# score model, e.g. 0.8. Unset, every die goes through the model
+FAST_PATH_CONF = _env("AI_FAST_PATH_CONF", None, float)
+
+# Inference executor: every worker thread owns its own Detector
+WORKERS = _env(
+    "AI_WORKERS", _profile.get("workers", max(1, (os.cpu_count() or 1) // 2)), int
+)
+# Requests waiting for a worker, beyond this /detect answers 503
+MAX_QUEUE = _env("AI_MAX_QUEUE", 16, int)
+# Micro-batching: a worker gathers up to BATCH_MAX queued frames into one
+# YOLO/classifier batch. With BATCH_WAIT_MS > 0 (opt-in) it also waits that
+# long after the first one for more; at 0 a lone request never waits
+BATCH_MAX = _env("AI_BATCH_MAX", _profile.get("batch_max", 8), int)
+BATCH_WAIT_MS = _env("AI_BATCH_WAIT_MS", 0.0, float)
+
+# Prefork server (`python -m serve.prefork`): PROCESSES worker processes share
+# the listening socket and the weights loaded before forking, each pinned to
+# its own share of the cores. Unless set, AI_WORKERS is then 1 per process and
+# AI_INTRA_OP_THREADS the number of cores of the process
+PROCESSES = _env("AI_PROCESSES", max(1, (os.cpu_count() or 1) // 2), int)
+
+# Threads of one inference call (torch.set_num_threads or the onnxruntime
+# intra-op threads), by default the cores are split between the workers. The
+# threads of a profile only hold for its number of workers. 0 keeps the
+# runtime default
+INTRA_OP_THREADS = _env(
+    "AI_INTRA_OP_THREADS",
+    (
+        _profile["intra_op_threads"]
+        if "intra_op_threads" in _profile and _profile.get("workers") == WORKERS
+        else max(1, (os.cpu_count() or 1) // WORKERS)
+    ),
+    int,
+)
+INTER_OP_THREADS = _env("AI_INTER_OP_THREADS", _profile.get("inter_op_threads", 0), int)
+# Inferences on a synthetic frame per worker before reporting ready
+WARMUP_RUNS = _env("AI_WARMUP_RUNS", 2, int)
+
+# Detection result cache keyed by the exact frame content (pixel hash),
+# AI_CACHE_SIZE=0 disables it
+CACHE_SIZE = _env("AI_CACHE_SIZE", 256, int)
+CACHE_TTL = _env("AI_CACHE_TTL", 30.0, float)
+
+# Adaptive tray ROI (opt-in): YOLO only sees the part of the frame where the
+# dice of recent frames of the same camera (`source` query parameter) were,
+# grown by ROI_MARGIN, with a full-frame check every ROI_RECHECK_EVERY frames.
+# AI_ROI_BOX="x1,y1,x2,y2" sets a fixed region instead
+ROI = _env("AI_ROI", False, _bool)
+ROI_MARGIN = _env("AI_ROI_MARGIN", 0.25, float)
+ROI_HISTORY = _env("AI_ROI_HISTORY", 16, int)
+ROI_RECHECK_EVERY = _env("AI_ROI_RECHECK_EVERY", 30, int)
+ROI_BOX = _env("AI_ROI_BOX", None, lambda value: tuple(map(int, value.split(","))))
+
+# Per-stage timings of every /detect response in a `Server-Timing` header
+# (also returned in the body with `/detect?debug=1`), histograms on /metrics
+SERVER_TIMING = _env("AI_SERVER_TIMING", True, _bool)
+
+# /detect_stream motion gating: a frame is "still" when the mean absolute
+# difference of its MOTION_WIDTH-wide grayscale thumbnail with the previous
+# one is below MOTION_THRESHOLD gray levels; the detector runs after
+# MOTION_SETTLE_FRAMES still frames
+MOTION_WIDTH = _env("AI_MOTION_WIDTH", 64, int)
+MOTION_THRESHOLD = _env("AI_MOTION_THRESHOLD", 3.0, float)
+MOTION_SETTLE_FRAMES = _env("AI_MOTION_SETTLE_FRAMES", 3, int)
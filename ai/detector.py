@@ -0,0 +1,167 @@
+from model.backends import load_dice_pos_model, load_dice_score_model
+from model.pip_counter import PIP_INPUT_SIZE, count_pips
+from model.preprocess import INPUT_SIZE, crop_boxes, load_image
+import numpy as np
+import time
+
+
+class Detector:
+    # single_stage: `dice_pos_model_path` is a 6-class YOLO (one class per face,
+    # trained with `--pips`) and no dice score model is loaded.
+    # score_arch: architecture of a torch dice score model, "base" or "tiny".
+    # imgsz, conf: YOLO input size and minimum box confidence (see
+    # `python -m utils.autotune` for the best values of a machine)
+    # fast_path_conf: cascade, the boxes whose pips the classical counter of
+    # model/pip_counter.py counts with at least this confidence skip the dice
+    # score model (None: every box goes through the model)
+    def __init__(
+        self,
+        dice_pos_model_path: str,
+        dice_score_model_path: str | None = None,
+        backend="torch",
+        single_stage=False,
+        score_arch="base",
+        imgsz=256,
+        conf=0.25,
+        fast_path_conf: float | None = None,
+    ):
+        self.dice_pos_model = load_dice_pos_model(
+            dice_pos_model_path, backend, imgsz, conf
+        )
+        self.dice_score_model = None
+        if not single_stage:
+            self.dice_score_model = load_dice_score_model(
+                dice_score_model_path, backend, score_arch
+            )
+        self.fast_path_conf = fast_path_conf
+
+    def __call__(self, image):
+        return self.detect_many([image])[0]
+
+    def detect_many(self, images, timings=None, regions=None, cascade=None):
+        # images: file paths or decoded RGB frames, each frame is decoded only once
+        # All frames go through YOLO as one batch, then the boxes are cut and
+        # resized straight out of the decoded frames (one vectorized op per
+        # frame) and classified together in a single forward pass.
+        # timings: optional dict, receives the seconds spent in every stage
+        # ("decode" when given file paths, "pos", "pips" with the cascade,
+        # "crop", "score") of this call, plus the split of "pos" into
+        # pre-processing, forward and post-processing.
+        # regions: optional (x1, y1, x2, y2) per frame (None = full frame), YOLO
+        # only sees that part of the frame (see model/roi.py); boxes are still
+        # returned in full-frame coordinates
+        # cascade: optional list, receives for every frame whether the score of
+        # each box comes from the pip counter (True) or the dice score model
+        clock = _Clock(timings)
+        frames = [load_image(x) if isinstance(x, str) else x for x in images]
+        if any(isinstance(x, str) for x in images):
+            clock.lap("decode")
+        if not frames:
+            return []
+        if regions is None:
+            regions = [None] * len(frames)
+        inputs = [
+            frame
+            if region is None
+            else frame[region[1] : region[3], region[0] : region[2]]
+            for frame, region in zip(frames, regions)
+        ]
+
+        if self.dice_score_model is None:
+            detections = self.dice_pos_model.batch_with_classes(inputs, timings)
+            clock.lap("pos")
+            return [
+                (
+                    self._to_ints(self._to_frame(bboxes, region)),
+                    [cls + 1 for cls in classes],
+                )
+                for (bboxes, classes, _), region in zip(detections, regions)
+            ]
+
+        all_bboxes = [
+            self._to_frame(bboxes, region)
+            for bboxes, region in zip(
+                self.dice_pos_model.batch(inputs, timings), regions
+            )
+        ]
+        clock.lap("pos")
+
+        counts = [[None] * len(bboxes) for bboxes in all_bboxes]
+        fast = [[False] * len(bboxes) for bboxes in all_bboxes]
+        if self.fast_path_conf is not None:
+            all_counts, confidences = count_pips(
+                np.concatenate(
+                    [
+                        crop_boxes(frame, bboxes, PIP_INPUT_SIZE)
+                        for frame, bboxes in zip(frames, all_bboxes)
+                    ]
+                )
+            )
+            start = 0
+            for i, bboxes in enumerate(all_bboxes):
+                end = start + len(bboxes)
+                counts[i] = all_counts[start:end]
+                fast[i] = [c >= self.fast_path_conf for c in confidences[start:end]]
+                start = end
+            clock.lap("pips")
+
+        # The classifier only sees the boxes the pip counter is not sure of
+        crops = np.concatenate(
+            [
+                crop_boxes(frame, [b for b, f in zip(bboxes, is_fast) if not f])
+                for frame, bboxes, is_fast in zip(frames, all_bboxes, fast)
+            ]
+        )
+        clock.lap("crop")
+
+        model_scores, _ = self.dice_score_model.classify(crops)
+        clock.lap("score")
+
+        results = []
+        model_scores = iter(model_scores)
+        for bboxes, frame_counts, is_fast in zip(all_bboxes, counts, fast):
+            scores = [
+                count if f else next(model_scores)
+                for count, f in zip(frame_counts, is_fast)
+            ]
+            results.append((self._to_ints(bboxes), scores))
+            if cascade is not None:
+                cascade.append(is_fast)
+
+        return results
+
+    def warmup(self, runs=1, shape=(480, 640, 3)):
+        # Pays the lazy initialization and first-inference cost of both models
+        # on a synthetic frame (a blank frame yields no boxes, so the classifier
+        # is warmed up separately)
+        frame = np.zeros(shape, dtype=np.uint8)
+        crops = np.zeros((1, INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+        for _ in range(runs):
+            self.detect_many([frame])
+            if self.dice_score_model is not None:
+                self.dice_score_model.classify(crops)
+            if self.fast_path_conf is not None:
+                count_pips(np.zeros((1, PIP_INPUT_SIZE, PIP_INPUT_SIZE, 3), np.uint8))
+
+    def _to_frame(self, bboxes, region):
+        # Region coordinates -> full-frame coordinates
+        if region is None:
+            return bboxes
+        return [[x + region[0], y + region[1], w, h] for x, y, w, h in bboxes]
+
+    def _to_ints(self, bboxes):
+        return [[int(x.item()) for x in bbox] for bbox in bboxes]
+
+
+class _Clock:
+    # Stage timer of `Detector.detect_many`, a no-op without a timings dict
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        if self.timings is None:
+            return
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - self.last
+        self.last = now
@@ -0,0 +1,175 @@
+from .data_utils import list_images, read_labels
+from PIL import Image
+import argparse
+import os
+import sqlite3
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    width INTEGER,
+    height INTEGER,
+    annotated INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    image TEXT NOT NULL REFERENCES images(name) ON DELETE CASCADE,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    w INTEGER NOT NULL,
+    h INTEGER NOT NULL,
+    pips INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS boxes_image ON boxes(image);
+"""
+
+
+def default_store_path(target_dir):
+    # data/targets -> data/annotations.db
+    return os.path.join(os.path.dirname(os.path.normpath(target_dir)), "annotations.db")
+
+
+class AnnotationStore:
+    # Every annotation in one SQLite file: the boxes (`x y w h pips`, like the
+    # txt label files), the image size and an annotated flag per image.
+    # Everything a training run needs is read with two queries
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        # WAL: the annotator can keep writing while a training run reads
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def annotated_names(self):
+        rows = self.conn.execute("SELECT name FROM images WHERE annotated = 1")
+        return {name for (name,) in rows}
+
+    def annotations(self):
+        # {name: ((width, height), [(x, y, w, h, pips)])} of every annotated image
+        records = {
+            name: ((width, height), [])
+            for name, width, height in self.conn.execute(
+                "SELECT name, width, height FROM images WHERE annotated = 1"
+            )
+        }
+        for name, *box in self.conn.execute(
+            "SELECT image, x, y, w, h, pips FROM boxes ORDER BY image, rowid"
+        ):
+            if name in records:
+                records[name][1].append(tuple(box))
+        return records
+
+    def updated_since(self, timestamp):
+        # Names of the images annotated or changed after `timestamp` (time.time())
+        rows = self.conn.execute(
+            "SELECT name FROM images WHERE annotated = 1 AND updated_at > ?",
+            (timestamp,),
+        )
+        return {name for (name,) in rows}
+
+    def get(self, name):
+        rows = self.conn.execute(
+            "SELECT x, y, w, h, pips FROM boxes WHERE image = ? ORDER BY rowid",
+            (name,),
+        )
+        return [tuple(row) for row in rows]
+
+    def put(self, name, labels, size=(None, None)):
+        self.put_many([(name, labels, size)])
+
+    def put_many(self, items):
+        # items: (name, [(x, y, w, h, pips)], (width, height)), one transaction
+        now = time.time()
+        with self.conn:
+            for name, labels, (width, height) in items:
+                self.conn.execute(
+                    "INSERT INTO images (name, width, height, annotated, updated_at)"
+                    " VALUES (?, ?, ?, 1, ?) ON CONFLICT(name) DO UPDATE SET"
+                    " width = COALESCE(excluded.width, width),"
+                    " height = COALESCE(excluded.height, height),"
+                    " annotated = 1, updated_at = excluded.updated_at",
+                    (name, width, height, now),
+                )
+                self.conn.execute("DELETE FROM boxes WHERE image = ?", (name,))
+                self.conn.executemany(
+                    "INSERT INTO boxes (image, x, y, w, h, pips)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    [(name, *label) for label in labels],
+                )
+
+    def import_txt(self, input_dir, target_dir):
+        # One `<name>.txt` per image, as written by the annotator before
+        images = {os.path.splitext(f)[0]: f for f in list_images(input_dir)}
+        items = []
+        for label_file in sorted(os.listdir(target_dir)):
+            base, ext = os.path.splitext(label_file)
+            if ext != ".txt" or base not in images:
+                continue
+            # Only the image header is read for the size
+            with Image.open(os.path.join(input_dir, images[base])) as img:
+                size = img.size
+            labels = read_labels(os.path.join(target_dir, label_file))
+            items.append((images[base], labels, size))
+        self.put_many(items)
+        return len(items)
+
+    def export_txt(self, target_dir):
+        os.makedirs(target_dir, exist_ok=True)
+        records = self.annotations()
+        for name, (_, labels) in records.items():
+            label_path = os.path.join(target_dir, os.path.splitext(name)[0] + ".txt")
+            with open(label_path, "w") as f:
+                for x, y, w, h, pips in labels:
+                    f.write(f"{x} {y} {w} {h} {pips}\n")
+        return len(records)
+
+
+def open_store(input_dir="data/inputs", target_dir="data/targets", path=None):
+    # A store that does not exist yet is filled from the txt label files
+    path = path or default_store_path(target_dir)
+    exists = os.path.exists(path)
+    store = AnnotationStore(path)
+    if not exists and os.path.isdir(input_dir) and os.path.isdir(target_dir):
+        count = store.import_txt(input_dir, target_dir)
+        print(f"[-- INFO --] Imported {count} annotations from {target_dir} to {path}")
+    return store
+
+
+def list_annotations(input_dir, target_dir, image_files=None, path=None):
+    # [(image_file, image_path, (width, height), labels)] for every annotated
+    # image of `input_dir`, all read from the store at once
+    store = open_store(input_dir, target_dir, path)
+    records = store.annotations()
+    store.close()
+    if image_files is None:
+        image_files = list_images(input_dir)
+    return [
+        (image_file, os.path.join(input_dir, image_file), *records[image_file])
+        for image_file in image_files
+        if image_file in records
+    ]
+
+
+if __name__ == "__main__":
+    # How to run (from `ai`): python -m model.annotation_store import|export
+    parser = argparse.ArgumentParser(description="Import/export txt annotations")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("--inputs", default="data/inputs")
+    parser.add_argument("--targets", default="data/targets")
+    parser.add_argument("--db", default=None)
+    args = parser.parse_args()
+
+    store = AnnotationStore(args.db or default_store_path(args.targets))
+    if args.command == "import":
+        count = store.import_txt(args.inputs, args.targets)
+        print(f"[-- SUCCESS --] Imported {count} annotations to {store.path}")
+    else:
+        count = store.export_txt(args.targets)
+        print(f"[-- SUCCESS --] Exported {count} annotations to {args.targets}")
+    store.close()
@@ -0,0 +1,143 @@
+# Inference backends are imported lazily so that the onnx backend never pulls
+# in torch or ultralytics.
+
+BACKENDS = ["torch", "onnx"]
+WEIGHTS_FORMATS = ["pickle", "safetensors"]
+
+DEFAULT_MODEL_PATHS = {
+    ("torch", "fp32"): ("output/dice-pos-model.pt", "output/dice-score-model.pth"),
+    ("onnx", "fp32"): ("output/dice-pos-model.onnx", "output/dice-score-model.onnx"),
+    # Written by `python -m model.quantize`
+    ("onnx", "int8"): (
+        "output/dice-pos-model.int8.onnx",
+        "output/dice-score-model.int8.onnx",
+    ),
+}
+
+# Single-stage 6-class YOLO, written by `scripts/train.sh pips`
+PIPS_MODEL_PATHS = {
+    ("torch", "fp32"): "output/dice-pips-model.pt",
+    ("onnx", "fp32"): "output/dice-pips-model.onnx",
+}
+
+
+def score_model_variant(model_path, arch="base"):
+    # output/dice-score-model.pth -> output/dice-score-model-tiny.pth
+    if arch == "base":
+        return model_path
+    return model_path.replace("dice-score-model", f"dice-score-model-{arch}")
+
+
+def safe_weights_variant(model_path):
+    # output/dice-pos-model.pt -> output/dice-pos-model.safetensors, the
+    # memory-mapped weights written by `python -m model.export_weights`
+    return model_path.rsplit(".", 1)[0] + ".safetensors"
+
+
+def default_model_paths(
+    backend="torch",
+    precision="fp32",
+    single_stage=False,
+    score_arch="base",
+    weights_format="pickle",
+):
+    # (dice pos model path, dice score model path)
+    # weights_format: "pickle" (the .pt/.pth checkpoints) or "safetensors",
+    # only the torch backend has both
+    if weights_format not in WEIGHTS_FORMATS:
+        raise Exception(f"Unknown weights format: {weights_format}")
+    paths = PIPS_MODEL_PATHS if single_stage else DEFAULT_MODEL_PATHS
+    if (backend, precision) not in paths:
+        raise Exception(f"No {precision} models for the {backend} backend.")
+    if single_stage:
+        pos_path, score_path = paths[(backend, precision)], None
+    else:
+        pos_path, score_path = paths[(backend, precision)]
+        score_path = score_model_variant(score_path, score_arch)
+    if backend == "torch" and weights_format == "safetensors":
+        pos_path = safe_weights_variant(pos_path)
+        score_path = score_path and safe_weights_variant(score_path)
+    return pos_path, score_path
+
+
+# (intra-op, inter-op) threads of the onnxruntime sessions, 0 = runtime default
+_onnx_threads = (0, 0)
+
+
+def import_backend(backend="torch"):
+    # Imports the runtime of a backend up front so that its cost can be measured
+    # apart from loading the models
+    if backend == "torch":
+        from . import dice_pos_model_inference, dice_score_model_inference  # noqa
+    elif backend == "onnx":
+        from . import dice_pos_model_onnx_inference  # noqa
+        from . import dice_score_model_onnx_inference  # noqa
+    else:
+        raise Exception(f"Unknown inference backend: {backend}")
+
+
+def configure_threads(backend="torch", intra_op=0, inter_op=0):
+    # 0 keeps the runtime default. Must run before the first inference: torch
+    # rejects changing the inter-op threads once its thread pool has started.
+    global _onnx_threads
+    if backend == "torch":
+        import torch
+
+        if intra_op:
+            torch.set_num_threads(intra_op)
+        if inter_op:
+            torch.set_num_interop_threads(inter_op)
+    else:
+        _onnx_threads = (intra_op, inter_op)
+
+
+def preload_models(backend, pos_path, score_path=None, arch="base"):
+    # Loads the torch weights once, before `serve/prefork.py` forks its worker
+    # processes; the models built later from the same paths reuse them.
+    # onnxruntime sessions do not survive a fork, so onnx models are always
+    # loaded by the process that runs them
+    if backend != "torch":
+        return
+    from .dice_pos_model_inference import preload as preload_pos
+
+    preload_pos(pos_path)
+    if score_path is not None:
+        from .dice_score_model_inference import preload as preload_score
+
+        preload_score(score_path, arch)
+
+
+def load_dice_pos_model(model_path, backend="torch", imgsz=256, conf=0.25):
+    # imgsz: YOLO input size, conf: minimum box confidence
+    if backend == "torch":
+        from .dice_pos_model_inference import DicePosModelInference
+
+        return DicePosModelInference(model_path=model_path, imgsz=imgsz, conf=conf)
+    if backend == "onnx":
+        from .dice_pos_model_onnx_inference import DicePosModelOnnxInference
+
+        return DicePosModelOnnxInference(
+            model_path=model_path,
+            imgsz=imgsz,
+            conf=conf,
+            intra_op_threads=_onnx_threads[0],
+            inter_op_threads=_onnx_threads[1],
+        )
+    raise Exception(f"Unknown inference backend: {backend}")
+
+
+def load_dice_score_model(model_path, backend="torch", arch="base"):
+    # `arch` only matters for torch, an onnx file carries its own graph
+    if backend == "torch":
+        from .dice_score_model_inference import DiceScoreModelInference
+
+        return DiceScoreModelInference(model_path=model_path, arch=arch)
+    if backend == "onnx":
+        from .dice_score_model_onnx_inference import DiceScoreModelOnnxInference
+
+        return DiceScoreModelOnnxInference(
+            model_path=model_path,
+            intra_op_threads=_onnx_threads[0],
+            inter_op_threads=_onnx_threads[1],
+        )
+    raise Exception(f"Unknown inference backend: {backend}")
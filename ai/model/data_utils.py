@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def list_images(input_dir):
+    # Any case of the extension, like `IMG_001.JPG`
+    return sorted(
+        f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def read_labels(target_path):
+    # One `x y w h pips` line per die
+    labels = []
+    with open(target_path, "r") as f:
+        for line in f:
+            parts = line.strip().split()
+            if len(parts) != 5:
+                continue
+            labels.append(tuple(map(int, parts)))
+    return labels
+
+
+def file_signature(path):
+    # Cheap change detection: (size, mtime in ns)
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def file_hash(path):
+    digest = hashlib.sha1(usedforsecurity=False)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def labels_hash(labels):
+    return hashlib.sha1(
+        repr(sorted(labels)).encode(), usedforsecurity=False
+    ).hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    # Written atomically, an interrupted run keeps the previous manifest
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def is_val_file(image_file, val_ratio=0.2):
+    # Decided by a hash of the file name alone, so an image never changes
+    # sides when others are added or removed
+    digest = hashlib.sha1(image_file.encode(), usedforsecurity=False).digest()
+    return int.from_bytes(digest[:4], "big") < val_ratio * (1 << 32)
+
+
+def split_files(image_files, val_ratio=0.2):
+    # The train/val split of both models: the YOLO dice detector and the dice
+    # score classifier (`split_dataset`) hold out the same images
+    train_files, val_files = [], []
+    for image_file in image_files:
+        if is_val_file(image_file, val_ratio):
+            val_files.append(image_file)
+        else:
+            train_files.append(image_file)
+    return train_files, val_files
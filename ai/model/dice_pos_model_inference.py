@@ -1,19 +1,127 @@
-import os
+from .weights_file import EXTENSION, load_weights
 from ultralytics.models import YOLO
+from ultralytics.models.yolo.detect import DetectionPredictor
+from ultralytics.nn.tasks import DetectionModel
+import json
+import numpy as np
+import os
+import torch
+
+# The NMS of ultralytics imports torchvision (and with it most of torch) on the
+# first inference: importing it here moves that cost to the model loading, and
+# lets the processes of serve/prefork.py share the modules
+import torchvision  # noqa
+
+
+# Stage names of the `speed` dict of ultralytics results
+SPEED_KEYS = [
+    ("pos_preprocess", "preprocess"),
+    ("pos_forward", "inference"),
+    ("pos_postprocess", "postprocess"),
+]
+
+# Fused networks loaded by `preload`, by model path
+_preloaded = {}
+
+
+def load_network(model_path):
+    # Fused detection network of an ultralytics checkpoint (.pt, unpickled), or
+    # of a weights file written by `python -m model.export_weights`: rebuilt
+    # from the model definition stored in its metadata, its tensors are
+    # memory-mapped from the file
+    if not os.path.exists(model_path):
+        raise Exception("Model file not found.")
+
+    if model_path.endswith(EXTENSION):
+        tensors, metadata = load_weights(model_path)
+        if metadata.get("model") != "dice-pos":
+            raise Exception(f"Not a dice pos model: {model_path}")
+        # No autograd graph for the forward pass that measures the strides
+        with torch.no_grad():
+            network = DetectionModel(cfg=json.loads(metadata["yaml"]), verbose=False)
+        network.fuse(verbose=False)
+        network.load_state_dict(tensors, assign=True)
+        network.names = {int(k): v for k, v in json.loads(metadata["names"]).items()}
+    else:
+        network = YOLO(model_path).model
+        network.fuse(verbose=False)  # type: ignore
+    network.eval()  # type: ignore
+    return network
+
+
+def preload(model_path):
+    # Loads the network once: every DicePosModelInference of this path built
+    # afterwards runs on these weights instead of its own copy, including the
+    # ones of worker processes forked later (the pages stay shared
+    # copy-on-write, nothing writes to them)
+    _preloaded[model_path] = load_network(model_path)
 
 
 class DicePosModelInference:
-    def __init__(self, model_path: str):
-        if not os.path.exists(model_path):
-            raise Exception("Model file not found.")
+    def __init__(self, model_path: str, imgsz=256, conf=0.25):
+        network = _preloaded.get(model_path)
+        if network is None:
+            network = load_network(model_path)
+
+        self.imgsz = imgsz
+        self.conf = conf
+        # Arguments of `YOLO.predict`. NMS is class-agnostic: a die is one box
+        # even when the 6-class model (single-stage mode) hesitates between
+        # two faces
+        self.predictor = DetectionPredictor(
+            overrides={
+                "imgsz": imgsz,
+                "conf": conf,
+                "agnostic_nms": True,
+                "mode": "predict",
+                "rect": True,
+                "batch": 1,
+                "save": False,
+                "verbose": False,
+            }
+        )
+        self.predictor.setup_model(network, verbose=False)
+        # The predictor runs a deep copy of the network: point the tensors of
+        # the copy back at the loaded ones (shared or memory-mapped)
+        _share_tensors(self.predictor.model.model, network)  # type: ignore
+
+    def __call__(self, image):
+        return self.batch([image])[0]
 
-        self.model = YOLO(model_path)
+    def batch(self, images, timings=None):
+        return [bboxes for bboxes, _, _ in self.batch_with_classes(images, timings)]
 
-    def __call__(self, image_path: str):
-        results = self.model(image_path, imgsz=256, conf=0.25, verbose=False)
-        bboxes = []
-        if len(results) > 0 and results[0].boxes is not None:
-            boxes = results[0].boxes.xyxy.cpu().numpy()
+    def batch_with_classes(self, images, timings=None):
+        # images: file paths or RGB arrays (ultralytics expects arrays in BGR order)
+        # All images go through the network as one batch
+        # Returns (bboxes, class ids, confidences) for every image
+        # timings: optional dict, receives the seconds of "pos_preprocess",
+        # "pos_forward" and "pos_postprocess" (as measured by ultralytics)
+        images = [
+            (
+                np.ascontiguousarray(image[:, :, ::-1])
+                if isinstance(image, np.ndarray)
+                else image
+            )
+            for image in images
+        ]
+        if not images:
+            return []
+
+        results = self.predictor(images)
+        if timings is not None:
+            for stage, key in SPEED_KEYS:
+                # Per-image shares of the batch, in milliseconds
+                seconds = sum(result.speed[key] for result in results) / 1000
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        return [self._to_bboxes(result) for result in results]
+
+    def _to_bboxes(self, result):
+        bboxes, classes, confs = [], [], []
+        if result.boxes is not None:
+            boxes = result.boxes.xyxy.cpu().numpy()
+            classes = [int(c) for c in result.boxes.cls.tolist()]
+            confs = result.boxes.conf.tolist()
             for box in boxes:
                 x1, y1, x2, y2 = box
 
@@ -24,4 +132,17 @@ class DicePosModelInference:
 
                 bboxes.append([x, y, w, h])
 
-        return bboxes
+        return bboxes, classes, confs
+
+
+def _share_tensors(network, source):
+    # Makes every parameter and buffer of `network` a view of the tensor of
+    # the same name in `source`, an identical (fused) architecture
+    pairs = zip(
+        network.state_dict(keep_vars=True).items(),
+        source.state_dict(keep_vars=True).items(),
+    )
+    for (name, tensor), (source_name, shared) in pairs:
+        if name != source_name or tensor.shape != shared.shape:
+            raise Exception(f"Loaded model does not match at {name}.")
+        tensor.data = shared.data
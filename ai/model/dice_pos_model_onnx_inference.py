@@ -0,0 +1,148 @@
+from PIL import Image
+import numpy as np
+import onnxruntime as ort
+import os
+import time
+
+
+def letterbox(frame, size, stride=None):
+    # Resize keeping the aspect ratio and pad, as ultralytics does: to a square,
+    # or only up to the next multiple of `stride` (minimal rectangle)
+    h, w = frame.shape[:2]
+    gain = min(size / h, size / w)
+    new_w, new_h = round(w * gain), round(h * gain)
+    out_w, out_h = size, size
+    if stride:
+        out_w = new_w + (size - new_w) % stride
+        out_h = new_h + (size - new_h) % stride
+    pad_x, pad_y = (out_w - new_w) / 2, (out_h - new_h) / 2
+    left, top = round(pad_x - 0.1), round(pad_y - 0.1)
+
+    canvas = np.full((out_h, out_w, 3), 114, dtype=np.uint8)
+    resized = Image.fromarray(frame).resize((new_w, new_h), Image.BILINEAR)  # type: ignore
+    canvas[top : top + new_h, left : left + new_w] = np.asarray(resized)
+    return canvas, gain, (left, top)
+
+
+def nms(boxes, scores, iou_threshold):
+    # boxes: (N, 4) xyxy, returns the kept indices sorted by score
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+class DicePosModelOnnxInference:
+    # Same interface as DicePosModelInference, backed by onnxruntime (no torch,
+    # no ultralytics). Expects a model exported by `model/export_onnx.py`.
+    def __init__(
+        self,
+        model_path: str,
+        imgsz=256,
+        conf=0.25,
+        iou=0.7,
+        max_det=300,
+        intra_op_threads=0,
+        inter_op_threads=0,
+    ):
+        if not os.path.exists(model_path):
+            raise Exception("Model file not found.")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+
+    def __call__(self, image):
+        return self.batch([image])[0]
+
+    def batch(self, images, timings=None):
+        return [bboxes for bboxes, _, _ in self.batch_with_classes(images, timings)]
+
+    def batch_with_classes(self, images, timings=None):
+        # images: file paths or RGB arrays
+        # Returns (bboxes, class ids, confidences) for every image
+        # timings: optional dict, receives the seconds of "pos_preprocess",
+        # "pos_forward" and "pos_postprocess"
+        if not images:
+            return []
+
+        started_at = time.perf_counter()
+
+        frames = []
+        for image in images:
+            if isinstance(image, str):
+                with Image.open(image) as img:
+                    image = np.asarray(img.convert("RGB"))
+            frames.append(image)
+
+        # Same-shaped frames only need a minimal rectangle, mixed ones a square
+        stride = 32 if len({frame.shape for frame in frames}) == 1 else None
+        inputs, transforms = [], []
+        for frame in frames:
+            canvas, gain, pad = letterbox(frame, self.imgsz, stride)
+            inputs.append(canvas)
+            transforms.append((gain, pad, frame.shape[:2]))
+
+        batch = np.stack(inputs).transpose(0, 3, 1, 2).astype(np.float32) / 255.0
+        batch = np.ascontiguousarray(batch)
+        preprocessed_at = time.perf_counter()
+        (output,) = self.session.run(None, {self.input_name: batch})
+        forwarded_at = time.perf_counter()
+        detections = [
+            self._to_bboxes(pred, *transform)
+            for pred, transform in zip(output, transforms)
+        ]
+
+        if timings is not None:
+            for stage, seconds in (
+                ("pos_preprocess", preprocessed_at - started_at),
+                ("pos_forward", forwarded_at - preprocessed_at),
+                ("pos_postprocess", time.perf_counter() - forwarded_at),
+            ):
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        return detections
+
+    def _to_bboxes(self, pred, gain, pad, shape):
+        # pred: (4 + nc, anchors) with boxes as center x, center y, width, height
+        pred = pred.T
+        class_scores = pred[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores.max(axis=1)
+        mask = scores > self.conf
+        pred, classes, scores = pred[mask], classes[mask], scores[mask]
+
+        cx, cy, w, h = pred[:, 0], pred[:, 1], pred[:, 2], pred[:, 3]
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        # Class-agnostic, like DicePosModelInference: with the 6-class model an
+        # ambiguous die scored as two faces must still come out as one box
+        keep = nms(boxes, scores, self.iou)[: self.max_det]
+        boxes, classes, scores = boxes[keep], classes[keep], scores[keep]
+
+        boxes[:, [0, 2]] -= pad[0]
+        boxes[:, [1, 3]] -= pad[1]
+        boxes /= gain
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, shape[1])
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])
+
+        bboxes = [[x1, y1, x2 - x1, y2 - y1] for x1, y1, x2, y2 in boxes]
+        return bboxes, classes.tolist(), scores.tolist()
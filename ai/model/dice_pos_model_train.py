@@ -1,84 +1,163 @@
-from sklearn.model_selection import train_test_split
+from .annotation_store import list_annotations
+from .data_utils import (
+    file_hash,
+    file_signature,
+    labels_hash,
+    load_manifest,
+    save_manifest,
+    split_files,
+)
 from ultralytics.models import YOLO
 from PIL import Image
+import argparse
+import concurrent.futures
 import os
 import shutil
 
 
-if __name__ == "__main__":
-    # Convert Dataset to YOLO Format
-    source_inputs = "data/inputs"
-    source_targets = "data/targets"
-    dest_dir = "yolo-data"
-
-    # Create directories
-    os.makedirs(f"{dest_dir}/images/train", exist_ok=True)
-    os.makedirs(f"{dest_dir}/labels/train", exist_ok=True)
-    os.makedirs(f"{dest_dir}/images/val", exist_ok=True)
-    os.makedirs(f"{dest_dir}/labels/val", exist_ok=True)
-
-    # Get all images and split
-    image_files = [
-        f for f in os.listdir(source_inputs) if f.endswith((".png", ".jpg", ".jpeg"))
-    ]
-    train_files, val_files = train_test_split(
-        image_files, test_size=0.2, random_state=42
-    )
+def link_image(src, dst):
+    # Hardlink, else symlink, else copy: the YOLO folder costs no extra space
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(src), dst)
+        except OSError:
+            shutil.copy(src, dst)
 
-    def convert_label_to_yolo_format(label_path, dest_label_path, image_path):
-        img = Image.open(image_path)
-        img_width, img_height = img.size
-
-        with open(label_path, "r") as f:
-            lines = f.readlines()
-
-        yolo_lines = []
-        for line in lines:
-            x, y, w, h, _ = map(int, line.strip().split())
-            x_center = (x + w / 2) / img_width
-            y_center = (y + h / 2) / img_height
-            w_norm = w / img_width
-            h_norm = h / img_height
-            yolo_lines.append(
-                f"0 {x_center:.6f} {y_center:.6f} {w_norm:.6f} {h_norm:.6f}"
-            )
-
-        with open(dest_label_path, "w") as f:
-            f.write("\n".join(yolo_lines))
-
-    # Process train
-    print(f"Processing {len(train_files)} training images...")
-    for img_file in train_files:
-        base = os.path.splitext(img_file)[0]
-        shutil.copy(
-            f"{source_inputs}/{img_file}", f"{dest_dir}/images/train/{img_file}"
-        )
-        convert_label_to_yolo_format(
-            f"{source_targets}/{base}.txt",
-            f"{dest_dir}/labels/train/{base}.txt",
-            f"{source_inputs}/{img_file}",
+
+def convert_label_to_yolo_format(labels, dest_label_path, image_path, size, pips):
+    img_width, img_height = size
+    if img_width is None or img_height is None:
+        # Only the image header is read for its size, the pixels are not decoded
+        with Image.open(image_path) as img:
+            img_width, img_height = img.size
+
+    yolo_lines = []
+    for x, y, w, h, n in labels:
+        cls = n - 1 if pips else 0
+        x_center = (x + w / 2) / img_width
+        y_center = (y + h / 2) / img_height
+        w_norm = w / img_width
+        h_norm = h / img_height
+        yolo_lines.append(
+            f"{cls} {x_center:.6f} {y_center:.6f} {w_norm:.6f} {h_norm:.6f}"
         )
 
-    # Process val
-    print(f"Processing {len(val_files)} validation images...")
-    for img_file in val_files:
-        base = os.path.splitext(img_file)[0]
-        shutil.copy(f"{source_inputs}/{img_file}", f"{dest_dir}/images/val/{img_file}")
+    with open(dest_label_path, "w") as f:
+        f.write("\n".join(yolo_lines))
+
+
+def remove_sample(dest_dir, split, image_file):
+    base = os.path.splitext(image_file)[0]
+    for path in (
+        f"{dest_dir}/images/{split}/{image_file}",
+        f"{dest_dir}/labels/{split}/{base}.txt",
+    ):
+        if os.path.lexists(path):
+            os.remove(path)
+
+
+def convert_dataset(source_inputs, source_targets, dest_dir, pips=False, workers=8):
+    # Brings `dest_dir` in line with the annotation store. `manifest.json`
+    # records the split, image signature and hash and boxes hash of every
+    # sample; unchanged ones are skipped and the rest are linked and converted
+    # on a thread pool.
+    for split in ("train", "val"):
+        os.makedirs(f"{dest_dir}/images/{split}", exist_ok=True)
+        os.makedirs(f"{dest_dir}/labels/{split}", exist_ok=True)
+
+    manifest_path = f"{dest_dir}/manifest.json"
+    manifest = load_manifest(manifest_path)
+    files = list_annotations(source_inputs, source_targets)
+    _, val_files = split_files([image_file for image_file, *_ in files])
+    val_files = set(val_files)
+
+    entries, todo = {}, []
+    for image_file, image_path, size, labels in files:
+        old = manifest.get(image_file, {})
+        entry = {
+            "split": "val" if image_file in val_files else "train",
+            "image": file_signature(image_path),
+            "image_hash": old.get("image_hash"),
+            "labels": labels_hash(labels),
+            "pips": pips,
+        }
+        entries[image_file] = entry
+        if old == entry:
+            continue
+        # Only touched? Same content, the link and the label file are still right
+        if (
+            entry["image_hash"]
+            and old == {**entry, "image": old["image"]}
+            and file_hash(image_path) == entry["image_hash"]
+        ):
+            continue
+        if old:
+            remove_sample(dest_dir, old["split"], image_file)
+        todo.append((image_file, image_path, size, labels, entry["split"]))
+
+    removed = set(manifest) - set(entries)
+    for image_file in removed:
+        remove_sample(dest_dir, manifest[image_file]["split"], image_file)
+
+    def convert(job):
+        image_file, image_path, size, labels, split = job
+        base = os.path.splitext(image_file)[0]
+        link_image(image_path, f"{dest_dir}/images/{split}/{image_file}")
         convert_label_to_yolo_format(
-            f"{source_targets}/{base}.txt",
-            f"{dest_dir}/labels/val/{base}.txt",
-            f"{source_inputs}/{img_file}",
+            labels, f"{dest_dir}/labels/{split}/{base}.txt", image_path, size, pips
         )
+        return file_hash(image_path)
+
+    print(f"Converting {len(todo)} of {len(files)} images...")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for job, image_hash in zip(todo, executor.map(convert, todo)):
+            entries[job[0]]["image_hash"] = image_hash
+    save_manifest(manifest_path, entries)
+
+    # Label caches of ultralytics are stale once anything changed
+    if todo or removed:
+        for split in ("train", "val"):
+            cache_path = f"{dest_dir}/labels/{split}.cache"
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+
+    num_val = sum(entry["split"] == "val" for entry in entries.values())
+    return len(entries) - num_val, num_val
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the YOLO dice detector")
+    parser.add_argument(
+        "--pips",
+        action="store_true",
+        help="one class per dice face, boxes and scores in a single stage",
+    )
+    args = parser.parse_args()
+
+    # Convert Dataset to YOLO Format
+    dest_dir = "yolo-data-pips" if args.pips else "yolo-data"
+    num_train, num_val = convert_dataset(
+        "data/inputs", "data/targets", dest_dir, pips=args.pips
+    )
+    print(f"✓ Dataset ready: {num_train} train, {num_val} val")
 
-    print(f"✓ Dataset ready: {len(train_files)} train, {len(val_files)} val")
+    names = [str(pips) for pips in range(1, 7)] if args.pips else ["dice"]
+    with open(f"{dest_dir}/data.yaml", "w") as f:
+        f.write(f"path: {dest_dir}\ntrain: images/train\nval: images/val\n\n")
+        f.write(f"nc: {len(names)}\nnames: {names}\n")
 
     model = YOLO()
     model.train(
-        data="yolo-data/data.yaml",
+        data=f"{dest_dir}/data.yaml",
         epochs=25,
         imgsz=256,
         batch=8,
         save=True,
         project="yolo-output",
+        name="pips" if args.pips else "train",
         exist_ok=True,
     )
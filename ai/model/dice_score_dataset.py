@@ -0,0 +1,216 @@
+from .annotation_store import list_annotations
+from .data_utils import (
+    file_hash,
+    file_signature,
+    labels_hash,
+    load_manifest,
+    save_manifest,
+    split_files,
+)
+from .preprocess import (
+    INPUT_SIZE,
+    NORMALIZE_MEAN,
+    NORMALIZE_STD,
+    crop_boxes,
+    load_image,
+)
+from torch.utils.data import Dataset, Subset
+import concurrent.futures
+import numpy as np
+import os
+import torch
+
+
+# Augmented variants of every crop: identity, flip top-bottom, flip left-right
+# and a 90° counter-clockwise rotation (like `Image.rotate(90)`)
+NUM_VARIANTS = 4
+
+# Crops cached with another method are extracted again
+CROP_METHOD = "roi-align"
+
+_MEAN = torch.tensor(NORMALIZE_MEAN).view(1, 3, 1, 1)
+_STD = torch.tensor(NORMALIZE_STD).view(1, 3, 1, 1)
+
+
+def extract_crops(args):
+    # Runs in a worker process: every die of one image, decoded once.
+    # Returns None when the image content still matches `known_hash`.
+    image_path, labels, known_hash = args
+    image_hash = file_hash(image_path)
+    if image_hash == known_hash:
+        return None
+
+    # Cropped like the Detector does at inference time
+    crops = crop_boxes(load_image(image_path), [label[:4] for label in labels])
+    scores = np.array([pips - 1 for *_, pips in labels], dtype=np.int64)
+    return crops, scores, image_hash
+
+
+def sync_crop_cache(input_dir, target_dir, cache_dir, workers=None):
+    # Keeps `crops.npy` (uint8, N x 32 x 32 x 3) and `labels.npy` (int64, N) in
+    # step with the annotation store. `manifest.json` records the size, mtime
+    # and hash of every source image and the hash of its boxes, with its slice
+    # of the arrays; only new or changed annotations are cropped again, in a
+    # process pool.
+    crops_path = os.path.join(cache_dir, "crops.npy")
+    labels_path = os.path.join(cache_dir, "labels.npy")
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+
+    manifest = {}
+    old_crops = old_labels = None
+    if os.path.exists(crops_path) and os.path.exists(labels_path):
+        manifest = load_manifest(manifest_path)
+        old_crops = np.load(crops_path, mmap_mode="r")
+        old_labels = np.load(labels_path, mmap_mode="r")
+
+    entries, todo = {}, []
+    for name, image_path, _, labels in list_annotations(input_dir, target_dir):
+        old = manifest.get(name)
+        if old and old.get("crop") != CROP_METHOD:
+            old = None
+        entry = {
+            "image": file_signature(image_path),
+            "labels": labels_hash(labels),
+            "crop": CROP_METHOD,
+        }
+        known_hash = None
+        if old and old["labels"] == entry["labels"]:
+            if old["image"] == entry["image"]:
+                entries[name] = old
+                continue
+            # Only touched? The worker compares the image hash before cropping
+            known_hash = old["image_hash"]
+        todo.append((name, entry, old, (image_path, labels, known_hash)))
+
+    extracted = {}
+    reused = len(entries)
+    results = []
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            jobs = [args for *_, args in todo]
+            results = list(executor.map(extract_crops, jobs, chunksize=16))
+    for (name, entry, old, _), result in zip(todo, results):
+        if result is None:
+            entries[name] = {**old, **entry}
+            reused += 1
+            continue
+        crops, scores, entry["image_hash"] = result
+        entries[name] = entry
+        extracted[name] = (crops, scores)
+
+    removed = len(set(manifest) - set(entries))
+    if not extracted and not removed and old_crops is not None:
+        if todo:
+            save_manifest(manifest_path, entries)
+        return reused, 0, 0
+
+    # Assemble the new arrays: reused slices are copied from the old memory map
+    names = sorted(entries)
+    counts = [
+        len(extracted[name][1]) if name in extracted else entries[name]["count"]
+        for name in names
+    ]
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_crops_path = os.path.join(cache_dir, "crops.tmp.npy")
+    crops = np.lib.format.open_memmap(
+        tmp_crops_path,
+        mode="w+",
+        dtype=np.uint8,
+        shape=(sum(counts), INPUT_SIZE, INPUT_SIZE, 3),
+    )
+    labels = np.empty(sum(counts), dtype=np.int64)
+    offset = 0
+    for name, count in zip(names, counts):
+        if name in extracted:
+            crops[offset : offset + count], labels[offset : offset + count] = extracted[
+                name
+            ]
+        else:
+            start = entries[name]["offset"]
+            crops[offset : offset + count] = old_crops[start : start + count]  # type: ignore
+            labels[offset : offset + count] = old_labels[start : start + count]  # type: ignore
+        entries[name] = {**entries[name], "offset": offset, "count": count}
+        offset += count
+    crops.flush()
+    del crops, old_crops, old_labels
+
+    os.replace(tmp_crops_path, crops_path)
+    np.save(labels_path, labels)
+    save_manifest(manifest_path, entries)
+    return reused, len(extracted), removed
+
+
+def collate_crops(batch):
+    # Turns (uint8 crop, label, variant) samples into a normalized float batch,
+    # the augmentation is applied with tensor ops on the whole batch
+    crops = torch.from_numpy(np.stack([crop for crop, _, _ in batch]))
+    labels = torch.tensor([label for _, label, _ in batch], dtype=torch.long)
+    variants = torch.tensor([variant for _, _, variant in batch])
+
+    # contiguous(): a permuted NHWC batch would stay channels-last, which the
+    # `view` in DiceScoreModel.forward cannot handle
+    images = crops.permute(0, 3, 1, 2).contiguous().float().div_(255)
+    images = (images - _MEAN) / _STD
+
+    images[variants == 1] = images[variants == 1].flip(2)
+    images[variants == 2] = images[variants == 2].flip(3)
+    images[variants == 3] = images[variants == 3].rot90(1, dims=(2, 3))
+    return images, labels
+
+
+class ProjectDataset(Dataset):
+    # Every annotated die in NUM_VARIANTS augmented variants. The crops live in
+    # a memory-mapped uint8 cache under `cache_dir`, updated incrementally by
+    # `sync_crop_cache`. Use with `collate_fn=collate_crops`.
+    def __init__(
+        self, input_dir, target_dir, cache_dir="var/crops", rebuild=False, workers=None
+    ):
+        # The annotations live in the store, the target folder may be empty
+        if not os.path.isdir(input_dir) or not list_annotations(input_dir, target_dir):
+            raise Exception(f"[-- ERROR --] No annotated image in {input_dir}.")
+
+        self.input_dir = input_dir
+        self.target_dir = target_dir
+        if rebuild and os.path.exists(os.path.join(cache_dir, "manifest.json")):
+            os.remove(os.path.join(cache_dir, "manifest.json"))
+        reused, extracted, removed = sync_crop_cache(
+            input_dir, target_dir, cache_dir, workers
+        )
+        print(
+            f"[-- INFO --] Crops: {reused} images reused, {extracted} extracted, "
+            f"{removed} removed"
+        )
+
+        self.crops = np.load(os.path.join(cache_dir, "crops.npy"), mmap_mode="r")
+        self.labels = np.load(os.path.join(cache_dir, "labels.npy"), mmap_mode="r")
+        # Slice of the crops of every image
+        self.entries = load_manifest(os.path.join(cache_dir, "manifest.json"))
+
+    def __len__(self):
+        return len(self.labels) * NUM_VARIANTS
+
+    def __getitem__(self, idx):
+        i, variant = divmod(idx, NUM_VARIANTS)
+        return self.crops[i], int(self.labels[i]), variant
+
+    def sample_indices(self, image_names):
+        # Indices of the samples (every variant) of the dice of these images
+        indices = []
+        for name in sorted(image_names):
+            entry = self.entries.get(name)
+            if entry is None:
+                continue
+            start = entry["offset"] * NUM_VARIANTS
+            indices.extend(range(start, start + entry["count"] * NUM_VARIANTS))
+        return indices
+
+
+def split_dataset(dataset, val_ratio=0.2):
+    # By image, with the split of the YOLO dataset (`split_files`): every crop
+    # and variant of a die stays on one side, and an image never changes sides
+    # when others are annotated
+    train_files, val_files = split_files(list(dataset.entries), val_ratio)
+    return (
+        Subset(dataset, dataset.sample_indices(train_files)),
+        Subset(dataset, dataset.sample_indices(val_files)),
+    )
@@ -1,3 +1,4 @@
+from .dice_score_model_tiny import DiceScoreModelTiny
 import torch.nn as nn
 import torch.nn.functional as F
 
@@ -26,3 +27,13 @@ class DiceScoreModel(nn.Module):
         x = self.dropout(x)
         x = self.fc2(x)
         return x
+
+
+# "base": DiceScoreModel, "tiny": the distilled depthwise-separable variant
+SCORE_ARCHS = {"base": DiceScoreModel, "tiny": DiceScoreModelTiny}
+
+
+def build_dice_score_model(arch="base"):
+    if arch not in SCORE_ARCHS:
+        raise Exception(f"Unknown dice score model architecture: {arch}")
+    return SCORE_ARCHS[arch]()
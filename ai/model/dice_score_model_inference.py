@@ -1,24 +1,64 @@
 import torch
-from .dice_score_model import DiceScoreModel
-from .dice_score_model_train import inter_transform
+from .dice_score_model import build_dice_score_model
+from .preprocess import normalize_batch, stack_crops
+from .weights_file import EXTENSION, load_weights
 import os
 
 
-class DiceScoreModelInference:
-    def __init__(self, model_path):
-        if not os.path.exists(model_path):
-            raise Exception("Model file not found.")
+# Networks loaded by `preload`, by (model path, architecture)
+_preloaded = {}
+
+
+def _load(model_path, arch):
+    if not os.path.exists(model_path):
+        raise Exception("Model file not found.")
+
+    if model_path.endswith(EXTENSION):
+        # Memory-mapped, the file knows its architecture
+        tensors, metadata = load_weights(model_path)
+        if metadata.get("model") != "dice-score":
+            raise Exception(f"Not a dice score model: {model_path}")
+        model = build_dice_score_model(metadata.get("arch", arch))
+        model.load_state_dict(tensors, assign=True)
+    else:
+        model = build_dice_score_model(arch)
+        model.load_state_dict(torch.load(model_path))
+    model.eval()
+    return model
+
+
+def preload(model_path, arch="base"):
+    # Every DiceScoreModelInference of this path built afterwards (also in
+    # forked worker processes) shares the network, the forward pass only reads it
+    _preloaded[(model_path, arch)] = _load(model_path, arch)
 
-        self.model = DiceScoreModel()
-        self.model.load_state_dict(torch.load(model_path))
-        self.model.eval()
+
+class DiceScoreModelInference:
+    def __init__(self, model_path, arch="base"):
+        self.model = _preloaded.get((model_path, arch))
+        if self.model is None:
+            self.model = _load(model_path, arch)
 
     def __call__(self, img):
-        tensor = inter_transform(img).unsqueeze(0)
+        scores, _ = self.classify_images([img])
+        return scores[0]
+
+    def classify_images(self, imgs):
+        # Classify many PIL crops (from one or several frames) in one forward pass
+        return self.classify(stack_crops(imgs))
+
+    def classify(self, crops):
+        # crops: uint8 array of shape (N, 32, 32, 3)
+        # Returns the score (1-6) and the softmax probabilities over the six faces of every crop
+        if len(crops) == 0:
+            return [], []
+
+        tensor = torch.from_numpy(normalize_batch(crops))
 
         with torch.no_grad():
             output = self.model(tensor)
-            _, pred = torch.max(output, 1)
-            score = pred.item() + 1
+            probs = torch.softmax(output, dim=1)
+            _, pred = torch.max(probs, 1)
 
-        return score
+        scores = [int(p) + 1 for p in pred.tolist()]
+        return scores, probs.tolist()
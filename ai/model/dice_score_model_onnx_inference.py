@@ -0,0 +1,39 @@
+from .preprocess import normalize_batch, stack_crops
+import numpy as np
+import onnxruntime as ort
+import os
+
+
+class DiceScoreModelOnnxInference:
+    # Same interface as DiceScoreModelInference, backed by onnxruntime (no torch)
+    def __init__(self, model_path, intra_op_threads=0, inter_op_threads=0):
+        if not os.path.exists(model_path):
+            raise Exception("Model file not found.")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, img):
+        scores, _ = self.classify_images([img])
+        return scores[0]
+
+    def classify_images(self, imgs):
+        return self.classify(stack_crops(imgs))
+
+    def classify(self, crops):
+        if len(crops) == 0:
+            return [], []
+
+        (output,) = self.session.run(None, {self.input_name: normalize_batch(crops)})
+        output = output - output.max(axis=1, keepdims=True)
+        probs = np.exp(output)
+        probs /= probs.sum(axis=1, keepdims=True)
+
+        scores = [int(p) + 1 for p in probs.argmax(axis=1)]
+        return scores, probs.tolist()
@@ -0,0 +1,104 @@
+from .dice_score_dataset import ProjectDataset, collate_crops, split_dataset
+from .dice_score_model import SCORE_ARCHS, build_dice_score_model
+from .backends import score_model_variant
+from .preprocess import INPUT_SIZE
+from torch.utils.data import DataLoader
+import os
+import time
+import torch
+import torch.nn as nn
+
+
+def count_params(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def count_flops(model):
+    # Multiply-adds of the convolutions and linear layers for one 32x32 crop,
+    # counted as 2 FLOPs each. Activations, pooling and BatchNorm are ignored
+    flops = []
+
+    def conv_hook(module, _, output):
+        kernel = module.kernel_size[0] * module.kernel_size[1]
+        macs = output.numel() * kernel * module.in_channels // module.groups
+        flops.append(2 * macs)
+
+    def linear_hook(module, _, output):
+        flops.append(2 * output.numel() * module.in_features)
+
+    hooks = []
+    for module in model.modules():
+        if isinstance(module, nn.Conv2d):
+            hooks.append(module.register_forward_hook(conv_hook))
+        elif isinstance(module, nn.Linear):
+            hooks.append(module.register_forward_hook(linear_hook))
+
+    model.eval()
+    with torch.no_grad():
+        model(torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE))
+    for hook in hooks:
+        hook.remove()
+    return sum(flops)
+
+
+def cpu_latency(model, batch_size=1, runs=50, threads=1):
+    # Median milliseconds of one forward pass on the CPU
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(threads)
+    model.eval()
+    tensor = torch.zeros(batch_size, 3, INPUT_SIZE, INPUT_SIZE)
+    timings = []
+    with torch.no_grad():
+        for _ in range(5):
+            model(tensor)
+        for _ in range(runs):
+            started_at = time.perf_counter()
+            model(tensor)
+            timings.append(time.perf_counter() - started_at)
+    torch.set_num_threads(num_threads)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+
+def accuracy(model, loader):
+    model.eval()
+    correct = 0
+    total = 0
+    with torch.no_grad():
+        for images, labels in loader:
+            _, predicted = torch.max(model(images), 1)
+            total += labels.size(0)
+            correct += (predicted == labels).sum().item()
+    return 100 * correct / total if total else 0.0
+
+
+def report(models, loader):
+    # models: {name: nn.Module}, printed side by side
+    print(
+        f"{'model':<10}{'params':>10}{'MFLOPs':>9}{'ms @1':>8}{'ms @16':>8}"
+        f"{'acc %':>8}"
+    )
+    for name, model in models.items():
+        print(
+            f"{name:<10}{count_params(model):>10}{count_flops(model) / 1e6:>9.2f}"
+            f"{cpu_latency(model, 1):>8.3f}{cpu_latency(model, 16):>8.3f}"
+            f"{accuracy(model, loader):>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    # How to run (from `ai`): python -m model.dice_score_model_report
+    dataset = ProjectDataset(input_dir="data/inputs", target_dir="data/targets")
+    _, val_dataset = split_dataset(dataset)
+    val_loader = DataLoader(
+        val_dataset, batch_size=32, shuffle=False, collate_fn=collate_crops
+    )
+
+    models = {}
+    for arch in SCORE_ARCHS:
+        model_path = score_model_variant("output/dice-score-model.pth", arch)
+        if os.path.exists(model_path):
+            models[arch] = build_dice_score_model(arch)
+            models[arch].load_state_dict(torch.load(model_path))
+    if not models:
+        raise Exception("[-- ERROR --] No trained dice score model in output.")
+    report(models, val_loader)
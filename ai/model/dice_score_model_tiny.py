@@ -0,0 +1,40 @@
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class SeparableConv(nn.Module):
+    # Depthwise 3x3 then pointwise 1x1 convolution, each followed by BatchNorm
+    def __init__(self, in_channels, out_channels):
+        super().__init__()
+        self.depthwise = nn.Conv2d(
+            in_channels, in_channels, 3, padding=1, groups=in_channels, bias=False
+        )
+        self.bn1 = nn.BatchNorm2d(in_channels)
+        self.pointwise = nn.Conv2d(in_channels, out_channels, 1, bias=False)
+        self.bn2 = nn.BatchNorm2d(out_channels)
+
+    def forward(self, x):
+        x = F.relu(self.bn1(self.depthwise(x)))
+        return F.relu(self.bn2(self.pointwise(x)))
+
+
+class DiceScoreModelTiny(nn.Module):
+    # ~11k parameters instead of ~1.8M, meant to be distilled from
+    # DiceScoreModel (see `dice_score_model_train.py --arch tiny`)
+    def __init__(self):
+        super().__init__()
+        self.conv1 = nn.Conv2d(3, 16, 3, padding=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(16)
+        self.conv2 = SeparableConv(16, 32)
+        self.conv3 = SeparableConv(32, 64)
+        self.conv4 = SeparableConv(64, 96)
+        self.pool = nn.MaxPool2d(2, 2)
+        self.fc = nn.Linear(96, 6)
+
+    def forward(self, x):
+        x = self.pool(F.relu(self.bn1(self.conv1(x))))  # 16x16
+        x = self.pool(self.conv2(x))  # 8x8
+        x = self.pool(self.conv3(x))  # 4x4
+        x = self.conv4(x)
+        x = F.adaptive_avg_pool2d(x, 1).flatten(1)
+        return self.fc(x)
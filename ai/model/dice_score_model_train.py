@@ -1,133 +1,271 @@
-from PIL import Image
-from .dice_score_model import DiceScoreModel
-from torch.utils.data import DataLoader, random_split
-from torch.utils.data import Dataset
-from torchvision import transforms
-import concurrent.futures
+from .annotation_store import open_store
+from .backends import score_model_variant
+from .dice_score_dataset import ProjectDataset, collate_crops, split_dataset
+from .dice_score_model import SCORE_ARCHS, build_dice_score_model
+from .dice_score_model_report import report
+from torch.utils.data import DataLoader, Subset
+import argparse
 import os
+import random
+import time
 import torch
-import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
 
 
-inter_transform = transforms.Compose(
-    [
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ]
-)
+# Learning rate of every architecture, the tiny model (with BatchNorm) learns
+# faster and needs a larger one
+LEARNING_RATES = {"base": 1e-4, "tiny": 3e-3}
+# Fine-tuning starts from trained weights, smaller steps keep what they learned
+FINETUNE_LR_SCALE = 0.1
 
 
-def process_sample(args):
-    image_path, x, y, w, h, score = args
-    img = Image.open(image_path).crop((x, y, x + w, y + h))
-    img = img.resize((32, 32))
+def distillation_loss(outputs, labels, teacher_outputs, temperature, alpha):
+    # Soft targets of the teacher (Hinton et al.) mixed with the true labels
+    soft = F.kl_div(
+        F.log_softmax(outputs / temperature, dim=1),
+        F.softmax(teacher_outputs / temperature, dim=1),
+        reduction="batchmean",
+    )
+    hard = F.cross_entropy(outputs, labels)
+    return alpha * soft * temperature**2 + (1 - alpha) * hard
 
-    label = int(score) - 1
-    records = []
 
-    variant_functs = [
-        lambda x: x,
-        lambda x: x.transpose(Image.FLIP_TOP_BOTTOM),  # type: ignore
-        lambda x: x.transpose(Image.FLIP_LEFT_RIGHT),  # type: ignore
-        lambda x: x.rotate(90),
-    ]
+def finetune_indices(dataset, train_indices, new_names, replay=1.0, seed=0):
+    # Training samples of a fine-tuning run: every training sample of the new
+    # or changed annotations, plus `replay` times as many samples of the other
+    # images so that the model does not forget them
+    new = set(dataset.sample_indices(new_names))
+    fresh = [i for i in train_indices if i in new]
+    old = [i for i in train_indices if i not in new]
+    replayed = random.Random(seed).sample(old, min(len(old), int(len(fresh) * replay)))
+    return fresh + sorted(replayed)
 
-    for vf in variant_functs:
-        var_img = vf(img)
-        img_tensor = inter_transform(var_img)
-        records.append((img_tensor, label))
 
-    return records
+def save_checkpoint(path, state):
+    # Written next to the target, then renamed over it
+    tmp_path = path + ".tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
 
 
-class ProjectDataset(Dataset):
-    def __init__(self, input_dir, target_dir):
-        if not os.path.isdir(input_dir) or not os.path.isdir(target_dir):
-            raise Exception("[-- ERROR --] The input and target folders must exist.")
-        if not os.listdir(input_dir) or not os.listdir(target_dir):
-            raise Exception(
-                "[-- ERROR --] Both input and target folders must not be empty."
+def train_epoch(model, loader, optimizer, teacher=None, temperature=4.0, alpha=0.7):
+    from tqdm import tqdm
+
+    model.train()
+    running_loss = 0.0
+    for images, labels in tqdm(loader, leave=False):
+        optimizer.zero_grad()
+        outputs = model(images)
+        if teacher is None:
+            loss = F.cross_entropy(outputs, labels)
+        else:
+            with torch.no_grad():
+                teacher_outputs = teacher(images)
+            loss = distillation_loss(
+                outputs, labels, teacher_outputs, temperature, alpha
             )
+        loss.backward()
+        optimizer.step()
+        running_loss += loss.item()
+    return running_loss / max(len(loader), 1)
 
-        self.input_dir = input_dir
-        self.target_dir = target_dir
-        self.records = []
-        targets = []
-        for target_file in os.listdir(target_dir):
-            if not target_file.endswith(".txt"):
-                continue
-            base = os.path.splitext(target_file)[0]
-            input_file = base + ".png"
-            input_path = os.path.join(input_dir, input_file)
-            target_path = os.path.join(target_dir, target_file)
-            if not os.path.exists(input_path):
-                continue
-            with open(target_path, "r") as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) != 5:
-                        continue
-                    x, y, w, h, score = map(int, parts)
-                    targets.append((input_path, x, y, w, h, score))
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            for result in executor.map(process_sample, targets):
-                self.records.extend(result)
-
-    def __len__(self):
-        return len(self.records)
-
-    def __getitem__(self, idx):
-        return self.records[idx]
+
+def evaluate(model, loader):
+    # Accuracy in % on a validation loader
+    model.eval()
+    correct = 0
+    total = 0
+    with torch.no_grad():
+        for images, labels in loader:
+            outputs = model(images)
+            _, predicted = torch.max(outputs.data, 1)
+            total += labels.size(0)
+            correct += (predicted == labels).sum().item()
+    return 100 * correct / total if total else 0.0
 
 
 if __name__ == "__main__":
+    # How to run (from `ai`): python -m model.dice_score_model_train
+    #   --finetune: from the deployed model, on the annotations changed since
+    #   --resume:   continues the last interrupted run from its checkpoint
     from tqdm import tqdm
 
+    parser = argparse.ArgumentParser(description="Train the dice score model")
+    parser.add_argument("--arch", choices=list(SCORE_ARCHS), default="base")
+    parser.add_argument(
+        "--teacher",
+        default="output/dice-score-model.pth",
+        help="base model distilled into a smaller --arch, empty trains on labels only",
+    )
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.7)
+    parser.add_argument("--epochs", type=int, default=None, help="25, 5 to fine-tune")
+    parser.add_argument("--lr", type=float, default=None)
+    parser.add_argument(
+        "--patience",
+        type=int,
+        default=5,
+        help="stops after this many epochs without a better val accuracy, 0 never",
+    )
+    parser.add_argument("--finetune", action="store_true")
+    parser.add_argument(
+        "--since",
+        type=float,
+        default=None,
+        help="fine-tunes on the annotations changed after this unix time, "
+        "by default the time the deployed model was written",
+    )
+    parser.add_argument(
+        "--replay",
+        type=float,
+        default=1.0,
+        help="older samples trained on per new sample when fine-tuning",
+    )
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--checkpoint-dir", default="var/checkpoints")
+    args = parser.parse_args()
+
     input_dir = "data/inputs"
     target_dir = "data/targets"
+    output_model_path = score_model_variant("output/dice-score-model.pth", args.arch)
+    checkpoint_dir = os.path.join(
+        args.checkpoint_dir, os.path.splitext(os.path.basename(output_model_path))[0]
+    )
+    last_path = os.path.join(checkpoint_dir, "last.pt")
+    best_path = os.path.join(checkpoint_dir, "best.pt")
+
+    checkpoint = None
+    if args.resume:
+        if not os.path.exists(last_path):
+            raise Exception(f"[-- ERROR --] No checkpoint to resume: {last_path}")
+        checkpoint = torch.load(last_path)
+        # The run continues with its own settings (and fine-tuning data)
+        args = argparse.Namespace(**{**checkpoint["args"], "resume": True})
+        print(f"[-- INFO --] Resuming {last_path} at epoch {checkpoint['epoch'] + 1}")
+    num_epochs = args.epochs or (5 if args.finetune else 25)
+    lr = args.lr or LEARNING_RATES[args.arch] * (
+        FINETUNE_LR_SCALE if args.finetune else 1
+    )
 
     dataset = ProjectDataset(input_dir=input_dir, target_dir=target_dir)
+    train_dataset, val_dataset = split_dataset(dataset)
+    train_indices = list(train_dataset.indices)
 
-    train_size = int(0.8 * len(dataset))
-    val_size = len(dataset) - train_size
-    train_dataset, val_dataset = random_split(dataset, [train_size, val_size])
+    model = build_dice_score_model(args.arch)
+    if args.finetune:
+        if not os.path.exists(output_model_path):
+            raise Exception(f"[-- ERROR --] No model to fine-tune: {output_model_path}")
+        if args.since is None:
+            args.since = os.path.getmtime(output_model_path)
+        store = open_store(input_dir, target_dir)
+        new_names = store.updated_since(args.since)
+        store.close()
+        train_indices = finetune_indices(dataset, train_indices, new_names, args.replay)
+        if not train_indices:
+            print(
+                "[-- INFO --] No annotation changed since "
+                f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(args.since))}"
+            )
+            raise SystemExit(0)
+        print(
+            f"[-- INFO --] Fine-tuning on {len(new_names)} new or changed images "
+            f"({len(train_indices)} samples with the replayed ones)"
+        )
+        model.load_state_dict(torch.load(output_model_path))
 
-    train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=32, shuffle=False)
+    train_loader = DataLoader(
+        Subset(dataset, train_indices),
+        batch_size=32,
+        shuffle=True,
+        collate_fn=collate_crops,
+    )
+    val_loader = DataLoader(
+        val_dataset, batch_size=32, shuffle=False, collate_fn=collate_crops
+    )
 
-    model = DiceScoreModel()
-    criterion = nn.CrossEntropyLoss()
-    optimizer = optim.AdamW(model.parameters(), lr=1e-4)
+    teacher = None
+    if args.arch != "base" and args.teacher:
+        if not os.path.exists(args.teacher):
+            raise Exception(f"[-- ERROR --] Teacher model not found: {args.teacher}")
+        teacher = build_dice_score_model("base")
+        teacher.load_state_dict(torch.load(args.teacher))
+        teacher.eval()
 
-    num_epochs = 25
-    epoch_pbar = tqdm(range(num_epochs), desc="Training")
+    optimizer = optim.AdamW(model.parameters(), lr=lr)
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    start_epoch = 0
+    best_acc = -1.0
+    stale_epochs = 0
+    if checkpoint is not None:
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        torch.set_rng_state(checkpoint["rng"])
+        start_epoch = checkpoint["epoch"]
+        best_acc = checkpoint["best_acc"]
+        stale_epochs = checkpoint["stale_epochs"]
+    elif args.finetune:
+        # The deployed model is the one to beat
+        best_acc = evaluate(model, val_loader)
+        save_checkpoint(best_path, {"model": model.state_dict(), "epoch": -1})
+        print(f"[-- INFO --] Deployed model: {best_acc:.2f}% val accuracy")
+
+    epoch_pbar = tqdm(range(start_epoch, num_epochs), desc="Training")
     for epoch in epoch_pbar:
-        model.train()
-        running_loss = 0.0
-        for images, labels in tqdm(train_loader, leave=False):
-            optimizer.zero_grad()
-            outputs = model(images)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
-            running_loss += loss.item()
-
-        avg_loss = running_loss / len(train_loader)
-
-        model.eval()
-        correct = 0
-        total = 0
-        with torch.no_grad():
-            for images, labels in tqdm(val_loader, leave=False):
-                outputs = model(images)
-                _, predicted = torch.max(outputs.data, 1)
-                total += labels.size(0)
-                correct += (predicted == labels).sum().item()
-        acc = 100 * correct / total
+        avg_loss = train_epoch(
+            model, train_loader, optimizer, teacher, args.temperature, args.alpha
+        )
+        acc = evaluate(model, val_loader)
         epoch_pbar.set_postfix({"Loss": f"{avg_loss:.4f}", "Acc": f"{acc:.2f}%"})
 
-    output_model_path = "output/dice-score-model.pth"
-    torch.save(model.state_dict(), output_model_path)
-    print(f"[-- SUCCESS --] Model saved to {output_model_path}")
+        # Ties keep the later weights (trained on more steps / the new data),
+        # only a strictly better accuracy resets the patience
+        if acc > best_acc:
+            stale_epochs = 0
+        else:
+            stale_epochs += 1
+        if acc >= best_acc:
+            best_acc = acc
+            save_checkpoint(best_path, {"model": model.state_dict(), "epoch": epoch})
+        save_checkpoint(
+            last_path,
+            {
+                "model": model.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "rng": torch.get_rng_state(),
+                "epoch": epoch + 1,
+                "best_acc": best_acc,
+                "stale_epochs": stale_epochs,
+                "args": vars(args),
+            },
+        )
+        if args.patience and stale_epochs >= args.patience:
+            print(
+                f"[-- INFO --] Early stop: no better val accuracy in {stale_epochs} epochs"
+            )
+            break
+
+    best = torch.load(best_path)
+    model.load_state_dict(best["model"])
+    if best["epoch"] < 0:
+        # Left untouched, the next fine-tuning run sees the same annotations
+        print(
+            f"[-- INFO --] No epoch beat the deployed model, {output_model_path} kept"
+        )
+    else:
+        os.makedirs(os.path.dirname(output_model_path), exist_ok=True)
+        torch.save(model.state_dict(), output_model_path)
+        print(
+            f"[-- SUCCESS --] Model of epoch {best['epoch'] + 1} ({best_acc:.2f}% val "
+            f"accuracy) saved to {output_model_path}"
+        )
+    # The next run starts from scratch
+    if os.path.exists(last_path):
+        os.remove(last_path)
+
+    # Params, FLOPs, CPU latency and accuracy next to the teacher
+    models = {args.arch: model}
+    if teacher is not None:
+        models = {"base": teacher, **models}
+    report(models, val_loader)
@@ -0,0 +1,64 @@
+from .backends import score_model_variant
+from .dice_score_model import SCORE_ARCHS, build_dice_score_model
+from .preprocess import INPUT_SIZE
+import os
+import shutil
+import tempfile
+import torch
+
+
+def export_dice_score_model(model_path, onnx_path, arch="base"):
+    model = build_dice_score_model(arch)
+    model.load_state_dict(torch.load(model_path))
+    model.eval()
+
+    dummy = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+    torch.onnx.export(
+        model,
+        (dummy,),
+        onnx_path,
+        input_names=["images"],
+        output_names=["logits"],
+        dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+        dynamo=False,
+    )
+    return onnx_path
+
+
+def export_dice_pos_model(model_path, onnx_path, imgsz=256):
+    from ultralytics.models import YOLO
+
+    # ultralytics writes the .onnx next to the checkpoint, export from a copy
+    # so that nothing besides `onnx_path` gets overwritten
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = shutil.copy(model_path, tmp)
+        # Dynamic axes so that micro-batches of any size can be run
+        exported = YOLO(checkpoint).export(
+            format="onnx", imgsz=imgsz, dynamic=True, simplify=False, verbose=False
+        )
+        shutil.move(exported, onnx_path)
+    return onnx_path
+
+
+if __name__ == "__main__":
+    # How to run (from `ai`): python -m model.export_onnx
+    output_dir = "output"
+
+    for arch in SCORE_ARCHS:
+        model_path = score_model_variant(f"{output_dir}/dice-score-model.pth", arch)
+        onnx_path = score_model_variant(f"{output_dir}/dice-score-model.onnx", arch)
+        if arch == "base" or os.path.exists(model_path):
+            export_dice_score_model(model_path, onnx_path, arch)
+            print(f"[-- SUCCESS --] Model saved to {onnx_path}")
+
+    export_dice_pos_model(
+        f"{output_dir}/dice-pos-model.pt", f"{output_dir}/dice-pos-model.onnx"
+    )
+    print(f"[-- SUCCESS --] Model saved to {output_dir}/dice-pos-model.onnx")
+
+    if os.path.exists(f"{output_dir}/dice-pips-model.pt"):
+        export_dice_pos_model(
+            f"{output_dir}/dice-pips-model.pt", f"{output_dir}/dice-pips-model.onnx"
+        )
+        print(f"[-- SUCCESS --] Model saved to {output_dir}/dice-pips-model.onnx")
@@ -0,0 +1,47 @@
+from .backends import safe_weights_variant, score_model_variant
+from .dice_score_model import SCORE_ARCHS, build_dice_score_model
+from .weights_file import save_weights
+import json
+import os
+import torch
+
+
+def export_dice_score_weights(model_path, weights_path, arch="base"):
+    model = build_dice_score_model(arch)
+    model.load_state_dict(torch.load(model_path))
+    return save_weights(
+        weights_path, model.state_dict(), {"model": "dice-score", "arch": arch}
+    )
+
+
+def export_dice_pos_weights(model_path, weights_path):
+    # The fused network, with the model definition needed to rebuild it
+    from ultralytics.models import YOLO
+
+    network = YOLO(model_path).model
+    network.fuse(verbose=False)  # type: ignore
+    metadata = {
+        "model": "dice-pos",
+        "yaml": json.dumps(network.yaml),  # type: ignore
+        "names": json.dumps(network.names),  # type: ignore
+    }
+    return save_weights(weights_path, network.state_dict(), metadata)  # type: ignore
+
+
+if __name__ == "__main__":
+    # How to run (from `ai`): python -m model.export_weights
+    output_dir = "output"
+
+    for arch in SCORE_ARCHS:
+        model_path = score_model_variant(f"{output_dir}/dice-score-model.pth", arch)
+        if arch == "base" or os.path.exists(model_path):
+            weights_path = safe_weights_variant(model_path)
+            export_dice_score_weights(model_path, weights_path, arch)
+            print(f"[-- SUCCESS --] Model saved to {weights_path}")
+
+    for name in ["dice-pos-model", "dice-pips-model"]:
+        model_path = f"{output_dir}/{name}.pt"
+        if name == "dice-pos-model" or os.path.exists(model_path):
+            weights_path = safe_weights_variant(model_path)
+            export_dice_pos_weights(model_path, weights_path)
+            print(f"[-- SUCCESS --] Model saved to {weights_path}")
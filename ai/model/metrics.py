@@ -0,0 +1,30 @@
+def iou(a, b):
+    # Boxes as (x, y, w, h)
+    ax, ay, aw, ah = a[:4]
+    bx, by, bw, bh = b[:4]
+    ix = max(0.0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0.0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    return inter / (aw * ah + bw * bh - inter + 1e-9)
+
+
+def match_boxes(predicted, expected, threshold=0.5):
+    # Greedy one-to-one matching by IoU, returns [(predicted index, expected index)]
+    pairs = sorted(
+        (
+            (iou(p, e), i, j)
+            for i, p in enumerate(predicted)
+            for j, e in enumerate(expected)
+        ),
+        reverse=True,
+    )
+    used_p, used_e, matches = set(), set(), []
+    for overlap, i, j in pairs:
+        if overlap < threshold:
+            break
+        if i in used_p or j in used_e:
+            continue
+        used_p.add(i)
+        used_e.add(j)
+        matches.append((i, j))
+    return matches
@@ -0,0 +1,91 @@
+import numpy as np
+
+
+# Classical pip counter, the fast path of the `Detector` cascade: the pips of a
+# clean die are high-contrast round blobs of one size. Crops are cut at this
+# size (larger than the classifier's, a pip stays several pixels wide)
+PIP_INPUT_SIZE = 48
+
+# Pip area as a share of the crop: smaller blobs are noise, larger ones are no
+# pip (shadow, edge of the die or of a neighbour)
+MIN_PIP_AREA = 0.003
+MAX_PIP_AREA = 0.06
+# Thickness of the outline of the die, as a share of the crop side, below
+# which a component touching the border is ignored
+MAX_OUTLINE_WIDTH = 0.08
+# Gray levels between the face and its pips below which the lighting is too
+# poor to trust the count, and above which it is fully trusted
+MIN_CONTRAST = 40
+FULL_CONTRAST = 100
+
+
+def count_pips(crops):
+    # crops: uint8 array of shape (N, S, S, 3), S ~ PIP_INPUT_SIZE.
+    # Returns the pip count (1-6) and a confidence in [0, 1] of every crop, 0
+    # when the crop does not look like a clean die
+    import cv2
+
+    counts, confidences = [], []
+    for crop in crops:
+        count, confidence = _count(cv2, cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY))
+        counts.append(count)
+        confidences.append(confidence)
+    return counts, confidences
+
+
+def _count(cv2, gray):
+    threshold, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # The pips are the smaller of the two Otsu classes (dark pips on a light
+    # face, or the other way round)
+    if np.count_nonzero(mask) > mask.size / 2:
+        mask = 255 - mask
+    pips = mask > 0
+    if not pips.any() or pips.all():
+        return 1, 0.0
+    contrast = abs(float(gray[pips].mean()) - float(gray[~pips].mean()))
+
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    stats = stats[1:]
+    height, width = gray.shape
+    x, y, w, h, area = stats.T
+    # Long thin components along the border of the crop are the outline of the
+    # die (or the edge of a neighbour) that the box includes, not pips. The mean
+    # thickness area / (w + h) of a line, an L or a frame is a few pixels; a
+    # pip cut by the box is short, it stays and makes the count untrusted
+    border = (x == 0) | (y == 0) | (x + w == width) | (y + h == height)
+    side = min(height, width)
+    outline = (
+        border
+        & (np.maximum(w, h) >= side / 2)
+        & (area / (w + h) < MAX_OUTLINE_WIDTH * side)
+    )
+    stats, border = stats[~outline], border[~outline]
+    foreground = stats[:, cv2.CC_STAT_AREA].sum()
+
+    areas = stats[:, cv2.CC_STAT_AREA] / (height * width)
+    kept = (areas >= MIN_PIP_AREA) & (areas <= MAX_PIP_AREA)
+    blobs, border = stats[kept], border[kept]
+    count = len(blobs)
+    if not 1 <= count <= 6:
+        return min(max(count, 1), 6), 0.0
+
+    # Every factor is 1 for a clean die, the confidence is the weakest one
+    x, y, w, h, area = blobs.T
+    # Foreground left out of the kept blobs (noise, merged pips, shadows)
+    stray = 1 - area.sum() / foreground
+    # Pips of a die have the same size ...
+    sizes = area.min() / area.max()
+    # ... are round (a disc fills pi/4 of its box, a few pixels wide one more) ...
+    fill = (area / (w * h)).min()
+    aspect = (np.minimum(w, h) / np.maximum(w, h)).min()
+    # ... and lie inside the face (a pip cut by the box may be missing one)
+    inside = not border.any()
+    factors = [
+        np.clip((contrast - MIN_CONTRAST) / (FULL_CONTRAST - MIN_CONTRAST), 0, 1),
+        np.clip(1 - stray / 0.2, 0, 1),
+        np.clip((sizes - 0.4) / 0.4, 0, 1),
+        np.clip((fill - 0.45) / 0.15, 0, 1),
+        np.clip((aspect - 0.5) / 0.3, 0, 1),
+        1.0 if inside else 0.0,
+    ]
+    return count, float(min(factors))
@@ -0,0 +1,81 @@
+from PIL import Image
+import io
+import numpy as np
+
+
+INPUT_SIZE = 32
+NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+NORMALIZE_STD = [0.229, 0.224, 0.225]
+
+_MEAN = np.array(NORMALIZE_MEAN, dtype=np.float32).reshape(1, 3, 1, 1)
+_STD = np.array(NORMALIZE_STD, dtype=np.float32).reshape(1, 3, 1, 1)
+
+
+def stack_crops(imgs):
+    # PIL crops -> uint8 array of shape (N, H, W, 3)
+    if not imgs:
+        return np.empty((0, INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+    return np.stack([np.asarray(img.convert("RGB"), dtype=np.uint8) for img in imgs])
+
+
+def normalize_batch(crops):
+    # uint8 (N, H, W, 3) -> normalized float32 (N, 3, H, W), like ToTensor + Normalize
+    batch = crops.transpose(0, 3, 1, 2).astype(np.float32) / 255.0
+    return np.ascontiguousarray((batch - _MEAN) / _STD)
+
+
+def decode_image(data):
+    # Encoded image bytes (e.g. an upload) -> RGB uint8 array of shape (H, W, 3)
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+def load_image(image_path):
+    with Image.open(image_path) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+def _sampling_weights(starts, lengths, size, sampling_ratio, limit):
+    # Interpolation weights along one axis: output pixel i of box n averages
+    # `sampling_ratio` bilinear samples taken inside its cell. Returns the
+    # weights, of shape (N, size, span), over the `span` pixels of the frame
+    # starting at `offsets[n]`, the same span for every box
+    steps = (np.arange(size * sampling_ratio, dtype=np.float32) + 0.5) / (
+        size * sampling_ratio
+    )
+    # Sample positions in pixel-index space (pixel k is centered at k + 0.5)
+    pos = np.clip(starts[:, None] + steps * lengths[:, None] - 0.5, 0, limit - 1)
+
+    first = np.floor(pos[:, 0]).astype(np.intp)
+    span = min(int((np.ceil(pos[:, -1]) - first).max()) + 1, limit)
+    offsets = np.minimum(first, limit - span)
+    pixels = (offsets[:, None] + np.arange(span)).astype(np.float32)
+
+    # Bilinear interpolation is a tent filter: weight 1 - |distance| up to 1px
+    pos = pos.reshape(len(starts), size, sampling_ratio, 1)
+    weights = np.maximum(1 - np.abs(pos - pixels[:, None, None, :]), 0)
+    return weights.mean(axis=2, dtype=np.float32), offsets
+
+
+def crop_boxes(frame, bboxes, size=INPUT_SIZE, sampling_ratio=2):
+    # Cuts and resizes every box [x, y, w, h] of an RGB frame in one vectorized
+    # step, ROI-align style: each output pixel averages sampling_ratio^2
+    # bilinear samples spread over its cell, which anti-aliases the downscale
+    # like PIL's resize does. The filter is separable, so the crops are two
+    # batched matrix products over same-sized windows of the frame.
+    # Returns uint8 crops of shape (N, size, size, 3)
+    bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+    if len(bboxes) == 0:
+        return np.empty((0, size, size, 3), dtype=np.uint8)
+
+    height, width = frame.shape[:2]
+    wx, x0 = _sampling_weights(bboxes[:, 0], bboxes[:, 2], size, sampling_ratio, width)
+    wy, y0 = _sampling_weights(bboxes[:, 1], bboxes[:, 3], size, sampling_ratio, height)
+
+    # (N, 3, span_y, span_x) views of the frame, no copy until the matmul
+    windows = np.lib.stride_tricks.sliding_window_view(
+        frame, (wy.shape[2], wx.shape[2]), axis=(0, 1)
+    )[y0, x0]
+    crops = wy[:, None] @ windows.astype(np.float32) @ wx.transpose(0, 2, 1)[:, None]
+    crops = crops.transpose(0, 2, 3, 1)
+    return np.clip(np.rint(crops), 0, 255).astype(np.uint8)
@@ -0,0 +1,182 @@
+from .annotation_store import list_annotations
+from .data_utils import split_files
+from .dice_pos_model_onnx_inference import DicePosModelOnnxInference, letterbox
+from .dice_score_model_onnx_inference import DiceScoreModelOnnxInference
+from .metrics import match_boxes
+from .preprocess import crop_boxes, load_image, normalize_batch
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+import argparse
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+
+
+class BatchReader(CalibrationDataReader):
+    def __init__(self, input_name, batches):
+        self.input_name = input_name
+        self.batches = iter(batches)
+
+    def get_next(self):
+        batch = next(self.batches, None)
+        return None if batch is None else {self.input_name: batch}
+
+
+def quantize_model(fp32_path, int8_path, mode, input_name=None, batches=None):
+    if mode == "dynamic":
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    else:
+        quantize_static(
+            fp32_path,
+            int8_path,
+            BatchReader(input_name, batches),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+        )
+
+
+def load_crops(samples):
+    crops, labels = [], []
+    for image_path, boxes in samples:
+        crops.append(crop_boxes(load_image(image_path), [box[:4] for box in boxes]))
+        labels.extend(pips for *_, pips in boxes)
+    return np.concatenate(crops), labels
+
+
+def score_accuracy(model, crops, labels):
+    scores, _ = model.classify(crops)
+    return 100 * sum(s == l for s, l in zip(scores, labels)) / max(len(labels), 1)
+
+
+def pos_metrics(model, samples):
+    # Precision, recall and F1 (%) of the predicted boxes at IoU 0.5
+    tp = fp = fn = 0
+    for image_path, boxes in samples:
+        predicted = model(load_image(image_path))
+        matched = len(match_boxes(predicted, boxes))
+        tp += matched
+        fp += len(predicted) - matched
+        fn += len(boxes) - matched
+    precision = 100 * tp / max(tp + fp, 1)
+    recall = 100 * tp / max(tp + fn, 1)
+    f1 = 2 * precision * recall / max(precision + recall, 1e-9)
+    return precision, recall, f1
+
+
+def quantize_dice_score_model(fp32_path, int8_path, train, val, mode, max_drop):
+    calib_crops, _ = load_crops(train)
+    val_crops, val_labels = load_crops(val)
+    batches = [
+        normalize_batch(calib_crops[i : i + 32]) for i in range(0, len(calib_crops), 32)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = os.path.join(tmp, "model.onnx")
+        fp32 = DiceScoreModelOnnxInference(fp32_path)
+        quantize_model(fp32_path, tmp_path, mode, fp32.input_name, batches)
+
+        fp32_acc = score_accuracy(fp32, val_crops, val_labels)
+        int8_acc = score_accuracy(
+            DiceScoreModelOnnxInference(tmp_path), val_crops, val_labels
+        )
+        print(
+            f"[-- INFO --] Dice score model accuracy: "
+            f"FP32 {fp32_acc:.2f}%, INT8 {int8_acc:.2f}% ({int8_acc - fp32_acc:+.2f})"
+        )
+        return _accept(tmp_path, int8_path, fp32_acc - int8_acc, max_drop)
+
+
+def quantize_dice_pos_model(fp32_path, int8_path, train, val, mode, max_drop):
+    fp32 = DicePosModelOnnxInference(fp32_path)
+    batches = []
+    for image_path, _ in train:
+        canvas, _, _ = letterbox(load_image(image_path), fp32.imgsz)
+        batches.append(canvas[None].transpose(0, 3, 1, 2).astype(np.float32) / 255.0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = os.path.join(tmp, "model.onnx")
+        quantize_model(fp32_path, tmp_path, mode, fp32.input_name, batches)
+
+        fp32_p, fp32_r, fp32_f1 = pos_metrics(fp32, val)
+        int8_p, int8_r, int8_f1 = pos_metrics(DicePosModelOnnxInference(tmp_path), val)
+        print(
+            f"[-- INFO --] Dice pos model: "
+            f"FP32 P {fp32_p:.2f}% R {fp32_r:.2f}% F1 {fp32_f1:.2f}%, "
+            f"INT8 P {int8_p:.2f}% R {int8_r:.2f}% F1 {int8_f1:.2f}% "
+            f"({int8_f1 - fp32_f1:+.2f})"
+        )
+        return _accept(tmp_path, int8_path, fp32_f1 - int8_f1, max_drop)
+
+
+def _accept(tmp_path, int8_path, drop, max_drop):
+    if drop > max_drop:
+        print(
+            f"[-- ERROR --] Accuracy drops by {drop:.2f} points (max {max_drop:.2f}), "
+            f"{int8_path} was not written."
+        )
+        return False
+    shutil.move(tmp_path, int8_path)
+    print(f"[-- SUCCESS --] Model saved to {int8_path}")
+    return True
+
+
+if __name__ == "__main__":
+    # How to run (from `ai`): python -m model.quantize
+    # The FP32 .onnx models come from `python -m model.export_onnx`
+    parser = argparse.ArgumentParser(description="INT8 quantization of the models")
+    parser.add_argument("--models", nargs="+", default=["pos", "score"])
+    parser.add_argument("--mode", choices=["static", "dynamic"], default="static")
+    parser.add_argument("--max-drop", type=float, default=1.0)
+    parser.add_argument("--calib-size", type=int, default=200)
+    args = parser.parse_args()
+
+    input_dir = "data/inputs"
+    target_dir = "data/targets"
+    output_dir = "output"
+
+    # (image_path, labels) of every annotated image
+    samples = {
+        image_file: (image_path, labels)
+        for image_file, image_path, _, labels in list_annotations(input_dir, target_dir)
+    }
+    # Calibrated on training images, the FP32/INT8 accuracy compared on the
+    # images neither model was trained on (the val split of both)
+    train_files, val_files = split_files(list(samples))
+    train = [samples[image_file] for image_file in train_files][: args.calib_size]
+    val = [samples[image_file] for image_file in val_files]
+    if not train or not val:
+        raise Exception("[-- ERROR --] Both splits must contain annotated images.")
+    print(
+        f"[-- INFO --] {len(train)} calibration images, {len(val)} held-out images "
+        f"({sum(len(labels) for _, labels in val)} dice)"
+    )
+
+    ok = True
+    if "score" in args.models:
+        ok &= quantize_dice_score_model(
+            f"{output_dir}/dice-score-model.onnx",
+            f"{output_dir}/dice-score-model.int8.onnx",
+            train,
+            val,
+            args.mode,
+            args.max_drop,
+        )
+    if "pos" in args.models:
+        ok &= quantize_dice_pos_model(
+            f"{output_dir}/dice-pos-model.onnx",
+            f"{output_dir}/dice-pos-model.int8.onnx",
+            train,
+            val,
+            args.mode,
+            args.max_drop,
+        )
+    sys.exit(0 if ok else 1)
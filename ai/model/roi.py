@@ -0,0 +1,107 @@
+from collections import deque
+import threading
+
+
+class TrayRoi:
+    # Region of interest of one camera: the dice always land in the same tray,
+    # so YOLO only needs to see the area where recent frames had dice. The
+    # region is the union of the last `history` detections grown by `margin`
+    # (a fraction of its size). The full frame is still checked every
+    # `recheck_every` frames, after a frame without dice and when a die
+    # touches the edge of the region. Regions are (x1, y1, x2, y2) in pixels.
+    def __init__(
+        self, margin=0.25, history=16, recheck_every=30, min_size=96, fixed=None
+    ):
+        self.margin = margin
+        self.recheck_every = recheck_every
+        self.min_size = min_size
+        # A configured region is always used as is
+        self.fixed = fixed
+        self.boxes = deque(maxlen=history)
+        self.shape = None
+        self.frames = 0
+        self.recheck = True
+        self.lock = threading.Lock()
+
+    def region(self, shape):
+        # Region to run the detector on for a frame of `shape`, None = full frame
+        height, width = shape[:2]
+        if self.fixed is not None:
+            x1, y1, x2, y2 = self.fixed
+            return max(x1, 0), max(y1, 0), min(x2, width), min(y2, height)
+
+        with self.lock:
+            if self.shape != shape[:2]:
+                self.shape = shape[:2]
+                self.boxes.clear()
+                self.recheck = True
+            self.frames += 1
+            if self.recheck or not self.boxes or self.frames >= self.recheck_every:
+                self.frames = 0
+                return None
+
+            x1 = min(box[0] for box in self.boxes)
+            y1 = min(box[1] for box in self.boxes)
+            x2 = max(box[2] for box in self.boxes)
+            y2 = max(box[3] for box in self.boxes)
+
+        pad_x = max((x2 - x1) * self.margin, (self.min_size - (x2 - x1)) / 2, 0)
+        pad_y = max((y2 - y1) * self.margin, (self.min_size - (y2 - y1)) / 2, 0)
+        x1, x2 = max(int(x1 - pad_x), 0), min(int(x2 + pad_x + 1), width)
+        y1, y2 = max(int(y1 - pad_y), 0), min(int(y2 + pad_y + 1), height)
+        if (x2 - x1) * (y2 - y1) >= 0.8 * width * height:
+            # Not worth cropping
+            return None
+        return x1, y1, x2, y2
+
+    def update(self, shape, bboxes, region=None):
+        # bboxes: full-frame [x, y, w, h] detected in `region` (None = full frame)
+        if self.fixed is not None:
+            return
+        height, width = shape[:2]
+        with self.lock:
+            if self.shape != shape[:2]:
+                return
+            if not bboxes:
+                # The dice may have left the region (or the tray is empty)
+                self.recheck = region is not None
+                return
+            x1 = min(x for x, _, _, _ in bboxes)
+            y1 = min(y for _, y, _, _ in bboxes)
+            x2 = max(x + w for x, _, w, _ in bboxes)
+            y2 = max(y + h for _, y, _, h in bboxes)
+            self.boxes.append((x1, y1, x2, y2))
+            self.recheck = region is not None and _touches_edge(
+                (x1, y1, x2, y2), region, width, height
+            )
+
+
+def _touches_edge(box, region, width, height, tolerance=2):
+    # True when the box reaches a side of the region that is not a frame side
+    x1, y1, x2, y2 = box
+    rx1, ry1, rx2, ry2 = region
+    return (
+        (rx1 > 0 and x1 - rx1 <= tolerance)
+        or (ry1 > 0 and y1 - ry1 <= tolerance)
+        or (rx2 < width and rx2 - x2 <= tolerance)
+        or (ry2 < height and ry2 - y2 <= tolerance)
+    )
+
+
+class RoiTracker:
+    # One TrayRoi per camera source (e.g. the `source` query parameter)
+    def __init__(self, max_sources=64, **roi_options):
+        self.max_sources = max_sources
+        self.roi_options = roi_options
+        self.rois = {}
+        self.lock = threading.Lock()
+
+    def get(self, source):
+        with self.lock:
+            roi = self.rois.get(source)
+            if roi is None:
+                if len(self.rois) >= self.max_sources:
+                    # Forget the oldest source
+                    self.rois.pop(next(iter(self.rois)))
+                roi = self.rois[source] = TrayRoi(**self.roi_options)
+            return roi
@@ -0,0 +1,91 @@
+import json
+import numpy as np
+import os
+import struct
+import torch
+
+
+# Flat weights file in the safetensors layout: the size of the header as an
+# 8-byte little-endian integer, a JSON header {name: {"dtype", "shape",
+# "data_offsets"}, "__metadata__": {str: str}}, then the raw tensor bytes.
+# Reading it unpickles nothing, and the tensors are views of a memory map of
+# the file instead of copies on the heap
+EXTENSION = ".safetensors"
+
+DTYPES = {
+    "F64": np.float64,
+    "F32": np.float32,
+    "F16": np.float16,
+    "I64": np.int64,
+    "I32": np.int32,
+    "I16": np.int16,
+    "I8": np.int8,
+    "U8": np.uint8,
+    "BOOL": np.bool_,
+}
+
+
+def save_weights(path, tensors, metadata=None):
+    # tensors: {name: tensor}, metadata: {str: str} stored in the header
+    dtype_names = {np.dtype(dtype): name for name, dtype in DTYPES.items()}
+    arrays = {
+        name: tensor.detach().cpu().contiguous().numpy()
+        for name, tensor in tensors.items()
+    }
+    # Widest items first: with the header padded to 8 bytes, every tensor
+    # starts aligned to its item size
+    order = sorted(arrays, key=lambda name: -arrays[name].itemsize)
+
+    header = {}
+    if metadata:
+        header["__metadata__"] = {str(k): str(v) for k, v in metadata.items()}
+    offset = 0
+    for name in order:
+        array = arrays[name]
+        if array.dtype not in dtype_names:
+            raise Exception(f"Unsupported dtype {array.dtype} of {name}.")
+        header[name] = {
+            "dtype": dtype_names[array.dtype],
+            "shape": list(array.shape),
+            "data_offsets": [offset, offset + array.nbytes],
+        }
+        offset += array.nbytes
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+    encoded += b" " * (-len(encoded) % 8)
+
+    # Written next to the target, then renamed over it
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for name in order:
+            f.write(arrays[name].tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_header(path):
+    # (header size, header) of a weights file
+    with open(path, "rb") as f:
+        (size,) = struct.unpack("<Q", f.read(8))
+        return size, json.loads(f.read(size))
+
+
+def read_metadata(path):
+    return read_header(path)[1].get("__metadata__", {})
+
+
+def load_weights(path):
+    # ({name: tensor}, metadata). The pages are only read when a tensor is
+    # first used and stay shared between the processes mapping the file; the
+    # map is copy-on-write, so a tensor written to never changes the file
+    size, header = read_header(path)
+    metadata = header.pop("__metadata__", {})
+    buffer = np.memmap(path, dtype=np.uint8, mode="c")
+    start = 8 + size
+    tensors = {}
+    for name, info in header.items():
+        begin, end = info["data_offsets"]
+        array = buffer[start + begin : start + end].view(DTYPES[info["dtype"]])
+        tensors[name] = torch.from_numpy(array.reshape(info["shape"]))
+    return tensors, metadata
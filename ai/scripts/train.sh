@@ -1,27 +1,33 @@
 #!/bin/bash
 
 # How to run: scripts/train.sh
+#             scripts/train.sh pips   (also trains the single-stage 6-class model)
+#             scripts/train.sh tiny   (also distills the tiny dice score model)
 
 . scripts/venv.sh
 
 if [[ ! -f "output/dice-score-model.pth" ]]; then
-  python model/dice_score_model_train.py
+  python -m model.dice_score_model_train
 fi
 
 if [[ ! -f "output/dice-pos-model.pth" ]]; then
-  cat >"yolo-data/data.yaml" <<EOF
-path: yolo-data
-train: images/train
-val: images/val
-
-nc: 1
-names: ['dice']
-EOF
-  python model/dice_pos_model_train.py
+  python -m model.dice_pos_model_train
 
   if [[ -f "yolo-output/train/weights/best.pt" ]]; then
     cp yolo-output/train/weights/best.pt output/dice-pos-model.pt
   fi
 fi
 
+if [[ "$1" == "tiny" && ! -f "output/dice-score-model-tiny.pth" ]]; then
+  python -m model.dice_score_model_train --arch tiny
+fi
+
+if [[ "$1" == "pips" && ! -f "output/dice-pips-model.pt" ]]; then
+  python -m model.dice_pos_model_train --pips
+
+  if [[ -f "yolo-output/pips/weights/best.pt" ]]; then
+    cp yolo-output/pips/weights/best.pt output/dice-pips-model.pt
+  fi
+fi
+
 rm -r yolo11n.pt
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+import hashlib
+import numpy as np
+import threading
+import time
+
+
+def content_hash(frame):
+    # Exact key: hash of the decoded pixels and their shape (sha1 is the fastest
+    # hashlib digest here, hashing the buffer directly avoids copying the frame)
+    digest = hashlib.sha1(str(frame.shape).encode(), usedforsecurity=False)
+    digest.update(memoryview(np.ascontiguousarray(frame)))
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    # LRU + TTL cache of detection results keyed by the exact frame content.
+    # Near-duplicate frames are not matched: a die is a few pixels of a whole
+    # frame hash, a re-roll in the same tray would get the previous scores
+    def __init__(self, max_entries=256, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (result, expires_at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, frame):
+        # Returns (key, cached result or None), the key is then given to `put`
+        key = content_hash(frame)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                # Expired entries are dropped lazily, LRU eviction bounds the rest
+                del self.entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return key, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return key, entry[0]
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = (result, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,102 @@
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+
+class QueueFullError(Exception):
+    def __init__(self, depth, capacity):
+        super().__init__(f"Inference queue is full ({depth}/{capacity}).")
+        self.depth = depth
+        self.capacity = capacity
+
+
+class InferenceExecutor:
+    # Runs detections on dedicated worker threads behind a bounded queue.
+    # YOLO predictors are not thread-safe, so each worker gets its own detector.
+    # Requests arriving within `max_wait` seconds of each other are coalesced
+    # into one `detect_many` call of at most `max_batch` frames.
+    def __init__(self, detector_factory, workers, max_queue, max_batch=1, max_wait=0.0):
+        self.max_queue = max_queue
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self._work,
+                args=(detector_factory(),),
+                name=f"inference-{i}",
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def submit(self, frame, region=None):
+        # region: (x1, y1, x2, y2) the detector looks at, None = full frame.
+        # The future resolves to (detector result, seconds spent waiting in the
+        # queue, {stage: seconds} of the detector batch the frame ran in, plus
+        # "batch_wait": seconds between leaving the queue and the batch start)
+        future = Future()
+        try:
+            self.queue.put_nowait((frame, region, time.perf_counter(), future))
+        except queue.Full:
+            raise QueueFullError(self.depth, self.max_queue)
+        return future
+
+    def shutdown(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _work(self, detector):
+        stopping = False
+        while not stopping:
+            job = self.queue.get()
+            if job is None:
+                break
+            # Every job also records when it left the queue: the wait for the
+            # rest of the batch is not queue wait
+            jobs = [(*job, time.perf_counter())]
+            deadline = jobs[0][4] + self.max_wait
+            while len(jobs) < self.max_batch:
+                try:
+                    job = self.queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                jobs.append((*job, time.perf_counter()))
+
+            self._run_batch(detector, jobs)
+
+    def _run_batch(self, detector, jobs):
+        jobs = [job for job in jobs if job[3].set_running_or_notify_cancel()]
+        if not jobs:
+            return
+        started_at = time.perf_counter()
+        timings = {}
+        try:
+            results = detector.detect_many(
+                [frame for frame, _, _, _, _ in jobs],
+                timings,
+                regions=[region for _, region, _, _, _ in jobs],
+            )
+        except BaseException as e:
+            for _, _, _, future, _ in jobs:
+                future.set_exception(e)
+            return
+        for (_, _, submitted_at, future, dequeued_at), result in zip(jobs, results):
+            future.set_result(
+                (
+                    result,
+                    dequeued_at - submitted_at,
+                    {**timings, "batch_wait": started_at - dequeued_at},
+                )
+            )
@@ -0,0 +1,168 @@
+import threading
+import time
+
+
+# Seconds, from sub-millisecond crops up to slow whole requests
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+DICE_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12)
+
+# Order of the stages in the Server-Timing header
+STAGES = [
+    "read",
+    "parse",
+    "decode",
+    "cache",
+    "queue",
+    "batch_wait",
+    "pos_preprocess",
+    "pos_forward",
+    "pos_postprocess",
+    "pos",
+    "pips",
+    "crop",
+    "score",
+    "total",
+]
+
+
+def _format(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Histogram:
+    # Cumulative histogram in the Prometheus text format, one series per value
+    # of a single label (e.g. stage="decode")
+    def __init__(self, name, help, buckets, label=None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.label = label
+        self.series = {}  # label value -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, label_value=None):
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_value, (counts, total, count) in sorted(
+                self.series.items(), key=lambda item: str(item[0])
+            ):
+                labels = "" if self.label is None else f'{self.label}="{label_value}",'
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(
+                        f'{self.name}_bucket{{{labels}le="{_format(bound)}"}} '
+                        f"{bucket_count}"
+                    )
+                labels = labels.rstrip(",")
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{self.name}_sum{labels} {total!r}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_value=None, amount=1):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_value, value in sorted(
+                self.values.items(), key=lambda item: str(item[0])
+            ):
+                labels = (
+                    "" if self.label is None else f'{{{self.label}="{label_value}"}}'
+                )
+                lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class InferenceMetrics:
+    # Telemetry of the detection endpoints, exposed on /metrics
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "ai_stage_seconds",
+            "Time spent in every stage of a detection request",
+            LATENCY_BUCKETS,
+            label="stage",
+        )
+        self.dice_per_frame = Histogram(
+            "ai_dice_per_frame", "Number of dice found in a frame", DICE_BUCKETS
+        )
+        self.requests = Counter(
+            "ai_requests_total", "Detection requests by outcome", label="outcome"
+        )
+
+    def record(self, timings, dice=None, outcome="ok"):
+        # timings: {stage: seconds} of one request
+        for stage, seconds in timings.items():
+            self.stage_seconds.observe(seconds, stage)
+        if dice is not None:
+            self.dice_per_frame.observe(dice)
+        self.requests.inc(outcome)
+
+    def render(self):
+        lines = []
+        for metric in (self.stage_seconds, self.dice_per_frame, self.requests):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def server_timing(timings):
+    # Server-Timing header value, durations in milliseconds
+    stages = [stage for stage in STAGES if stage in timings]
+    stages += sorted(set(timings) - set(stages))
+    return ", ".join(f"{stage};dur={timings[stage] * 1000:.2f}" for stage in stages)
+
+
+class RequestTimingMiddleware:
+    # ASGI middleware: FastAPI reads and parses the whole multipart body before
+    # the endpoint runs, so the upload can only be timed around `receive`.
+    # Stores `started_at` (perf_counter) and `body_received_at` in request.state
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        state = scope.setdefault("state", {})
+        state["started_at"] = time.perf_counter()
+
+        async def timed_receive():
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body"):
+                state["body_received_at"] = time.perf_counter()
+            return message
+
+        await self.app(scope, timed_receive, send)
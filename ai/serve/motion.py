@@ -0,0 +1,52 @@
+from PIL import Image
+import io
+import numpy as np
+
+
+def motion_thumbnail(data, width=64):
+    # Small grayscale version of an encoded frame. For JPEG, `draft` lets the
+    # decoder scale down by up to 8x in the DCT domain, so this stays far
+    # cheaper than a full decode.
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("L", (max(img.width // 8, width), max(img.height // 8, width)))
+        gray = img.convert("L")
+        height = max(1, round(gray.height * width / gray.width))
+        small = gray.resize((width, height), Image.BILINEAR)  # type: ignore
+        return np.asarray(small, dtype=np.float32)
+
+
+class MotionGate:
+    # Frame differencing on thumbnails: fires once when the scene has stayed
+    # still (mean absolute difference below `threshold` gray levels) for
+    # `settle_frames` consecutive frames, then waits for motion again.
+    def __init__(self, threshold=3.0, settle_frames=3):
+        self.threshold = threshold
+        self.settle_frames = settle_frames
+        self.previous = None
+        self.still_frames = 0
+        self.fired = False
+
+    def update(self, thumbnail):
+        # Returns (moving, settled): `moving` when this frame differs from the
+        # previous one, `settled` only on the frame that should be detected
+        previous, self.previous = self.previous, thumbnail
+        if previous is None or previous.shape != thumbnail.shape:
+            moving = True
+        else:
+            moving = float(np.abs(thumbnail - previous).mean()) > self.threshold
+
+        if moving:
+            self.still_frames = 0
+            self.fired = False
+            return True, False
+
+        self.still_frames += 1
+        if self.still_frames >= self.settle_frames and not self.fired:
+            self.fired = True
+            return False, True
+        return False, False
+
+    def reset(self):
+        # Detect again on the next still frame (e.g. after a failed detection)
+        self.still_frames = self.settle_frames - 1
+        self.fired = False
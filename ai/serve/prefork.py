@@ -0,0 +1,119 @@
+from model.backends import configure_threads, import_backend, preload_models
+import api
+import argparse
+import config
+import os
+import signal
+import socket
+import time
+import uvicorn
+
+
+def core_sets(processes, cores=None):
+    # Splits the usable cores into `processes` contiguous sets of near-equal
+    # size; with more processes than cores every process gets a single core
+    cores = sorted(os.sched_getaffinity(0) if cores is None else cores)
+    if processes >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(processes)]
+    size, extra = divmod(len(cores), processes)
+    sets = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (i < extra)
+        sets.append(cores[start:end])
+        start = end
+    return sets
+
+
+def run_worker(sock, cores, log_level):
+    # In the forked process: pinned to its cores, one inference thread using
+    # all of them unless AI_WORKERS / AI_INTRA_OP_THREADS say otherwise
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    os.sched_setaffinity(0, cores)
+    if "AI_WORKERS" not in os.environ:
+        config.WORKERS = 1
+    if "AI_INTRA_OP_THREADS" not in os.environ:
+        config.INTRA_OP_THREADS = max(1, len(cores) // config.WORKERS)
+    server = uvicorn.Server(uvicorn.Config(api.app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+def serve(processes, host="0.0.0.0", port=8000, log_level="info"):
+    # The kernel spreads the connections of the shared listening socket over
+    # the processes accepting on it
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+
+    # Everything the processes can share is loaded before forking: the runtime
+    # libraries and the torch weights. No inference runs here and torch keeps
+    # a single thread, so that no thread pool exists at fork time
+    started_at = time.perf_counter()
+    import_backend(config.BACKEND)
+    configure_threads(config.BACKEND, 1)
+    preload_models(config.BACKEND, *api.model_paths(), arch=config.SCORE_ARCH)
+    print(
+        f"[-- INFO --] Preloaded the {config.BACKEND} models in "
+        f"{time.perf_counter() - started_at:.2f}s"
+    )
+
+    cores = core_sets(processes)
+    children = {}  # pid -> index in `cores`
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock, cores[index], log_level)
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    stopping = False
+
+    def stop(signum, _):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(len(cores)):
+        spawn(index)
+    print(
+        f"[-- INFO --] Serving on http://{host}:{port} with {len(cores)} processes, "
+        f"cores {cores}"
+    )
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        # A crashed process is replaced, after a pause against crash loops
+        print(
+            f"[-- ERROR --] Worker process {pid} exited with status {status}, "
+            "restarting it"
+        )
+        time.sleep(1)
+        spawn(index)
+    sock.close()
+
+
+if __name__ == "__main__":
+    # How to run (from `ai`): python -m serve.prefork --processes 4
+    parser = argparse.ArgumentParser(description="Prefork multi-process AI server")
+    parser.add_argument("--processes", type=int, default=config.PROCESSES)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    serve(args.processes, args.host, args.port, args.log_level)
@@ -0,0 +1,1026 @@
+from model.metrics import iou
+from model.preprocess import INPUT_SIZE
+import numpy as np
+import os
+import tempfile
+
+
+def test_dice_score_model_onnx_parity():
+    """Test that the onnx backend classifies crops like the torch backend"""
+    import torch
+    from model.dice_score_model import DiceScoreModel
+    from model.dice_score_model_inference import DiceScoreModelInference
+    from model.dice_score_model_onnx_inference import DiceScoreModelOnnxInference
+    from model.export_onnx import export_dice_score_model
+
+    torch.manual_seed(0)
+    rng = np.random.default_rng(0)
+    crops = rng.integers(0, 256, (16, INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, "dice-score-model.pth")
+        onnx_path = os.path.join(tmp, "dice-score-model.onnx")
+        torch.save(DiceScoreModel().state_dict(), model_path)
+        export_dice_score_model(model_path, onnx_path)
+
+        torch_scores, torch_probs = DiceScoreModelInference(model_path).classify(crops)
+        onnx_scores, onnx_probs = DiceScoreModelOnnxInference(onnx_path).classify(crops)
+
+    assert onnx_scores == torch_scores
+    assert np.allclose(onnx_probs, torch_probs, atol=1e-4)
+
+    print("✓ test_dice_score_model_onnx_parity passed")
+
+
+def test_crop_boxes():
+    """Test that the vectorized crops match PIL's crop + resize"""
+    from model.preprocess import crop_boxes
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    frame = np.asarray(Image.fromarray(frame).resize((640, 480)))
+    bboxes = [(10, 20, 60, 60), (300, 200, 85, 70), (590, 430, 50, 50)]
+
+    crops = crop_boxes(frame, bboxes)
+    assert crops.shape == (3, INPUT_SIZE, INPUT_SIZE, 3) and crops.dtype == np.uint8
+    for crop, (x, y, w, h) in zip(crops, bboxes):
+        img = Image.fromarray(frame).crop((x, y, x + w, y + h))
+        expected = np.asarray(img.resize((INPUT_SIZE, INPUT_SIZE)), dtype=np.float32)
+        assert np.abs(crop - expected).mean() < 4
+
+    # Without downscaling, the crop is the frame region itself
+    crop = crop_boxes(frame, [(8, 8, INPUT_SIZE, INPUT_SIZE)], sampling_ratio=1)[0]
+    assert (crop == frame[8 : 8 + INPUT_SIZE, 8 : 8 + INPUT_SIZE]).all()
+    assert crop_boxes(frame, []).shape == (0, INPUT_SIZE, INPUT_SIZE, 3)
+
+    print("✓ test_crop_boxes passed")
+
+
+def test_score_frame():
+    """Test the end-to-end metrics of one frame"""
+    from utils.evaluate import score_frame
+
+    labels = [(10, 10, 50, 50, 3), (100, 10, 50, 50, 5)]
+    result = score_frame([[12, 11, 50, 50], [101, 9, 48, 52]], [3, 5], labels)
+    assert result["tp"] == 2 and result["fp"] == 0 and result["roll_correct"]
+
+    result = score_frame([[12, 11, 50, 50], [300, 300, 40, 40]], [3, 2], labels)
+    assert (result["tp"], result["fp"], result["fn"]) == (1, 1, 1)
+    assert result["pips_correct"] == 1 and not result["roll_correct"]
+
+    result = score_frame([[12, 11, 50, 50], [101, 9, 48, 52]], [3, 6], labels)
+    assert result["pips_correct"] == 1 and not result["roll_correct"]
+
+    print("✓ test_score_frame passed")
+
+
+def test_tray_roi():
+    """Test that the tray ROI follows the dice and falls back to the full frame"""
+    from model.roi import TrayRoi
+
+    shape = (480, 640, 3)
+    roi = TrayRoi(margin=0.25, recheck_every=5)
+    assert roi.region(shape) is None
+    roi.update(shape, [[200, 150, 50, 50], [300, 200, 60, 60]])
+
+    region = roi.region(shape)
+    assert region is not None
+    x1, y1, x2, y2 = region
+    assert x1 < 200 and y1 < 150 and x2 > 360 and y2 > 260
+    assert (x2 - x1) * (y2 - y1) < 640 * 480 / 2
+
+    # A die on the edge of the region, or no die, triggers a full-frame check
+    roi.update(shape, [[x1, 200, 50, 50]], region)
+    assert roi.region(shape) is None
+    roi.update(shape, [[200, 150, 50, 50]])
+    region = roi.region(shape)
+    roi.update(shape, [], region)
+    assert roi.region(shape) is None
+
+    # And so does every `recheck_every`-th frame
+    roi.update(shape, [[200, 150, 50, 50]])
+    regions = [roi.region(shape) for _ in range(5)]
+    assert regions[-1] is None and all(regions[:-1])
+
+    print("✓ test_tray_roi passed")
+
+
+def test_preload_models():
+    """Test that preloaded weights are shared by the models built afterwards"""
+    import torch
+    from model.dice_score_model import DiceScoreModel
+    from model.dice_score_model_inference import DiceScoreModelInference, preload
+
+    torch.manual_seed(0)
+    crops = np.random.default_rng(0).integers(
+        0, 256, (4, INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, "dice-score-model.pth")
+        torch.save(DiceScoreModel().state_dict(), model_path)
+        expected = DiceScoreModelInference(model_path).classify(crops)
+
+        preload(model_path)
+        first = DiceScoreModelInference(model_path)
+        second = DiceScoreModelInference(model_path)
+        assert first.model is second.model
+        assert first.classify(crops)[0] == expected[0]
+    print("✓ test_preload_models passed")
+
+
+def test_core_sets():
+    """Test the split of the cores between the prefork worker processes"""
+    from serve.prefork import core_sets
+
+    assert core_sets(2, [0, 1, 2, 3]) == [[0, 1], [2, 3]]
+    assert core_sets(3, [0, 1, 2, 3]) == [[0, 1], [2], [3]]
+    assert core_sets(3, [4, 5]) == [[4], [5], [4]]
+    print("✓ test_core_sets passed")
+
+
+def test_weights_file():
+    """Test that the safetensors weights load like the pickled checkpoint"""
+    import torch
+    from model.dice_score_model import DiceScoreModel
+    from model.dice_score_model_inference import DiceScoreModelInference
+    from model.export_weights import export_dice_score_weights
+    from model.weights_file import load_weights, save_weights
+
+    torch.manual_seed(0)
+    crops = np.random.default_rng(0).integers(
+        0, 256, (8, INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        tensors = {
+            "a": torch.arange(3, dtype=torch.uint8),
+            "b": torch.rand(2, 3),
+            "c": torch.tensor(7),
+        }
+        save_weights(os.path.join(tmp, "t.safetensors"), tensors, {"k": "v"})
+        loaded, metadata = load_weights(os.path.join(tmp, "t.safetensors"))
+        assert metadata == {"k": "v"}
+        assert all(torch.equal(tensors[name], loaded[name]) for name in tensors)
+
+        model_path = os.path.join(tmp, "dice-score-model.pth")
+        weights_path = os.path.join(tmp, "dice-score-model.safetensors")
+        torch.save(DiceScoreModel().state_dict(), model_path)
+        export_dice_score_weights(model_path, weights_path)
+        expected = DiceScoreModelInference(model_path).classify(crops)
+        actual = DiceScoreModelInference(weights_path).classify(crops)
+        assert expected[0] == actual[0]
+        assert np.allclose(expected[1], actual[1], atol=1e-6)
+    print("✓ test_weights_file passed")
+
+
+def test_dice_pos_weights():
+    """Test that the rebuilt detector finds the same boxes as the checkpoint"""
+    model_path = "output/dice-pos-model.pt"
+    if not os.path.exists(model_path):
+        print(f"- test_dice_pos_weights skipped ({model_path} not found)")
+        return
+
+    from model.dice_pos_model_inference import DicePosModelInference
+    from model.export_weights import export_dice_pos_weights
+
+    frames = [np.random.default_rng(0).integers(0, 256, (480, 640, 3), np.uint8)]
+    input_dir = "data/inputs"
+    if os.path.isdir(input_dir):
+        from model.preprocess import load_image
+
+        image_files = sorted(os.listdir(input_dir))[:4]
+        frames += [load_image(os.path.join(input_dir, f)) for f in image_files]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        weights_path = export_dice_pos_weights(
+            model_path, os.path.join(tmp, "dice-pos-model.safetensors")
+        )
+        expected = DicePosModelInference(model_path).batch(frames)
+        actual = DicePosModelInference(weights_path).batch(frames)
+    for expected_bboxes, bboxes in zip(expected, actual):
+        assert np.allclose(expected_bboxes, bboxes, atol=1e-3)
+    print("✓ test_dice_pos_weights passed")
+
+
+def test_finetune_indices():
+    """Test that fine-tuning trains on the changed annotations plus a replay"""
+    import time
+    from model.annotation_store import AnnotationStore
+    from model.dice_score_dataset import NUM_VARIANTS, ProjectDataset
+    from model.dice_score_model_train import finetune_indices
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AnnotationStore(os.path.join(tmp, "annotations.db"))
+        store.put("a.png", [(0, 0, 10, 10, 1)], (64, 64))
+        since = time.time()
+        time.sleep(0.01)
+        store.put("b.png", [(0, 0, 10, 10, 2), (20, 20, 10, 10, 3)], (64, 64))
+        new_names = store.updated_since(since)
+        store.close()
+    assert new_names == {"b.png"}
+
+    class Dataset:
+        # Crop 0 is the die of a.png, crops 1-2 the dice of b.png
+        entries = {
+            "a.png": {"offset": 0, "count": 1},
+            "b.png": {"offset": 1, "count": 2},
+        }
+        sample_indices = ProjectDataset.sample_indices
+
+    train_indices = list(range(3 * NUM_VARIANTS))
+    indices = finetune_indices(Dataset(), train_indices, new_names, replay=0.5)
+    fresh = list(range(NUM_VARIANTS, 3 * NUM_VARIANTS))
+    assert indices[: len(fresh)] == fresh
+    assert len(indices) == len(fresh) + NUM_VARIANTS
+    assert all(i < NUM_VARIANTS for i in indices[len(fresh) :])
+    print("✓ test_finetune_indices passed")
+
+
+def test_pareto_front():
+    """Test that the autotuner keeps the settings no other one beats"""
+    from utils.autotune import choose, pareto_front
+
+    def candidate(latency_ms, accuracy, conf=0.25, fps=10):
+        return {
+            "latency_p95_ms": latency_ms,
+            "accuracy": accuracy,
+            "conf": conf,
+            "fps": fps,
+        }
+
+    fast = candidate(10, 90)
+    slow_worse = candidate(20, 85)
+    mid = candidate(15, 95.5)
+    tie = candidate(15, 95.5, conf=0.4)
+    busier = candidate(15, 95.5, fps=30)
+    best = candidate(30, 96)
+    # A large batch has a high throughput but every request waits for it
+    batched = candidate(40, 96, fps=100)
+    front = pareto_front([best, slow_worse, tie, fast, mid, batched])
+    assert front == [fast, mid, best]
+    assert front[1] is mid  # the default confidence wins a tie
+    assert front[2] is best
+    assert pareto_front([mid, busier, tie]) == [busier]  # then the throughput
+    assert choose(front, max_drop=0.5) is mid
+    assert choose(front, max_drop=0) is best
+    assert choose(front, max_drop=10) is fast
+    print("✓ test_pareto_front passed")
+
+
+def test_pip_counter():
+    """Test that the classical pip counter counts clean dice and doubts the rest"""
+    from model.pip_counter import PIP_INPUT_SIZE, count_pips
+
+    size = PIP_INPUT_SIZE
+    layouts = {
+        1: [(2, 2)],
+        2: [(1, 1), (3, 3)],
+        3: [(1, 1), (2, 2), (3, 3)],
+        4: [(1, 1), (1, 3), (3, 1), (3, 3)],
+        5: [(1, 1), (1, 3), (2, 2), (3, 1), (3, 3)],
+        6: [(1, 1), (1, 3), (2, 1), (2, 3), (3, 1), (3, 3)],
+    }
+    yy, xx = np.mgrid[:size, :size]
+    crops = []
+    for pips in layouts.values():
+        face = np.full((size, size), 235, dtype=np.uint8)
+        for row, col in pips:
+            cy, cx = row * size / 4, col * size / 4
+            face[(yy - cy) ** 2 + (xx - cx) ** 2 <= 4.5**2] = 20
+        crops.append(np.repeat(face[:, :, None], 3, axis=2))
+    crops = np.stack(crops)
+
+    counts, confidences = count_pips(crops)
+    assert counts == list(layouts)
+    assert min(confidences) > 0.8
+
+    # Poor lighting, a blank crop and a pip cut by the box are not trusted
+    _, confidences = count_pips((crops * 0.25).astype(np.uint8))
+    assert max(confidences) < 0.5
+    _, (confidence,) = count_pips(np.full((1, size, size, 3), 200, dtype=np.uint8))
+    assert confidence == 0.0
+    _, (confidence,) = count_pips(crops[4:5, :, 10:])
+    assert confidence < 0.5
+    print("✓ test_pip_counter passed")
+
+
+class StubDetector:
+    # Stands in for `Detector` in the executor tests: records its batches,
+    # returns (frame, region) per frame and fails on a "bad" frame
+    def __init__(self, gate=None):
+        import threading
+
+        self.gate = gate
+        self.running = threading.Event()
+        self.batches = []
+
+    def detect_many(self, frames, timings=None, regions=None):
+        self.running.set()
+        if self.gate is not None:
+            self.gate.wait()
+        self.batches.append(list(frames))
+        if "bad" in frames:
+            raise ValueError("bad frame")
+        timings["stub"] = 0.001
+        return [(frame, region) for frame, region in zip(frames, regions)]
+
+
+def test_executor_queue():
+    """Test that the executor runs frames off a bounded queue and rejects overflow"""
+    import threading
+    import time
+    from serve.executor import InferenceExecutor, QueueFullError
+
+    gate = threading.Event()
+    detector = StubDetector(gate)
+    executor = InferenceExecutor(lambda: detector, workers=1, max_queue=2)
+    try:
+        first = executor.submit("f0", (0, 0, 10, 10))
+        assert detector.running.wait(5)  # f0 holds the worker
+        queued = [executor.submit("f1"), executor.submit("f2")]
+        try:
+            executor.submit("f3")
+            assert False, "a full queue must raise"
+        except QueueFullError as e:
+            assert (e.depth, e.capacity) == (2, 2)
+        time.sleep(0.1)
+        gate.set()
+        result, queue_wait, timings = first.result(5)
+        assert result == ("f0", (0, 0, 10, 10))
+        assert queue_wait < 0.1 and set(timings) == {"stub", "batch_wait"}
+        results = [future.result(5) for future in queued]
+        assert [result for result, _, _ in results] == [("f1", None), ("f2", None)]
+        # f1 and f2 waited in the queue while f0 ran
+        assert all(queue_wait >= 0.1 for _, queue_wait, _ in results)
+        # Without batching every frame runs alone, a failure only hits its own
+        failed, after = executor.submit("bad"), executor.submit("f4")
+        try:
+            failed.result(5)
+            assert False, "the detector error must reach the future"
+        except ValueError:
+            pass
+        assert after.result(5)[0] == ("f4", None)
+        assert detector.batches == [["f0"], ["f1"], ["f2"], ["bad"], ["f4"]]
+    finally:
+        gate.set()
+        executor.shutdown()
+    print("✓ test_executor_queue passed")
+
+
+def test_executor_batching():
+    """Test that the executor coalesces frames into bounded, ordered batches"""
+    import time
+    from serve.executor import InferenceExecutor
+
+    detector = StubDetector()
+    executor = InferenceExecutor(
+        lambda: detector, workers=1, max_queue=16, max_batch=3, max_wait=0.3
+    )
+    try:
+        started_at = time.perf_counter()
+        futures = [executor.submit(f"f{i}", (i, i, 10, 10)) for i in range(7)]
+        results = [future.result(5) for future in futures]
+        # Two full batches at once, the last frame after waiting `max_wait`
+        assert detector.batches == [["f0", "f1", "f2"], ["f3", "f4", "f5"], ["f6"]]
+        elapsed = time.perf_counter() - started_at
+        assert 0.3 <= elapsed < 2
+        assert [result for result, _, _ in results] == [
+            (f"f{i}", (i, i, 10, 10)) for i in range(7)
+        ]
+        assert all(timings["stub"] == 0.001 for _, _, timings in results)
+        # f6 waited for a batch that never filled, not in the queue
+        _, queue_wait, timings = results[6]
+        assert queue_wait < 0.3 <= timings["batch_wait"]
+
+        # A failing batch fails every frame in it, and only those
+        detector.batches.clear()
+        futures = [executor.submit(frame) for frame in ["f7", "bad", "f8", "f9"]]
+        for future in futures[:3]:
+            try:
+                future.result(5)
+                assert False, "the detector error must reach every future"
+            except ValueError:
+                pass
+        assert futures[3].result(5)[0] == ("f9", None)
+        assert detector.batches == [["f7", "bad", "f8"], ["f9"]]
+    finally:
+        executor.shutdown()
+
+    # Without a batching window a lone frame runs at once
+    executor = InferenceExecutor(
+        lambda: detector, workers=1, max_queue=16, max_batch=8, max_wait=0
+    )
+    try:
+        started_at = time.perf_counter()
+        result, _, timings = executor.submit("f10").result(5)
+        assert result == ("f10", None)
+        assert time.perf_counter() - started_at < 0.05
+        assert timings["batch_wait"] < 0.01
+    finally:
+        executor.shutdown()
+    print("✓ test_executor_batching passed")
+
+
+def test_request_timing():
+    """Test that the upload is timed before FastAPI parses the body"""
+    import asyncio
+    from serve.metrics import RequestTimingMiddleware, server_timing
+
+    seen = {}
+
+    async def endpoint(scope, receive, send):
+        # Reads the body in two chunks, like a slow upload
+        if scope["type"] != "http":
+            return
+        while (await receive()).get("more_body"):
+            seen["chunks"] = seen.get("chunks", 0) + 1
+        seen.update(scope["state"])
+
+    chunks = [
+        {"type": "http.request", "body": b"ab", "more_body": True},
+        {"type": "http.request", "body": b"cd", "more_body": False},
+    ]
+
+    async def receive():
+        await asyncio.sleep(0.05)
+        return chunks.pop(0)
+
+    app = RequestTimingMiddleware(endpoint)
+    asyncio.run(app({"type": "http"}, receive, None))
+    assert seen["chunks"] == 1
+    assert seen["body_received_at"] - seen["started_at"] >= 0.1
+    # Other connections (WebSocket, lifespan) pass through untouched
+    scope = {"type": "websocket"}
+    asyncio.run(app(scope, receive, None))
+    assert "state" not in scope
+    assert server_timing({"decode": 0.002, "parse": 0.001, "read": 0.1}) == (
+        "read;dur=100.00, parse;dur=1.00, decode;dur=2.00"
+    )
+    print("✓ test_request_timing passed")
+
+
+def test_quantize_accept():
+    """Test that an INT8 model is only kept within the allowed accuracy drop"""
+    from model.quantize import _accept
+
+    # (fp32 accuracy, int8 accuracy, kept) with a 1 point budget
+    cases = [
+        (98.0, 97.5, True),
+        (98.0, 97.0, True),  # exactly at the threshold
+        (98.0, 98.4, True),  # INT8 better
+        (98.0, 96.9, False),
+        (90.0, 80.0, False),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for fp32, int8, kept in cases:
+            tmp_path = os.path.join(tmp, "model.onnx")
+            int8_path = os.path.join(tmp, "model.int8.onnx")
+            with open(tmp_path, "w") as f:
+                f.write("int8")
+            assert _accept(tmp_path, int8_path, fp32 - int8, max_drop=1.0) is kept
+            assert os.path.exists(int8_path) is kept
+            assert os.path.exists(tmp_path) is not kept
+            if kept:
+                os.remove(int8_path)
+    print("✓ test_quantize_accept passed")
+
+
+def test_split_dataset():
+    """Test that the classifier split keeps every image (and its flips) on one side"""
+    from model.data_utils import is_val_file
+    from model.dice_score_dataset import NUM_VARIANTS, ProjectDataset, split_dataset
+
+    class Dataset:
+        sample_indices = ProjectDataset.sample_indices
+
+        def __init__(self, names):
+            self.entries = {
+                name: {"offset": i * 2, "count": 2} for i, name in enumerate(names)
+            }
+
+        def image_of(self, index):
+            crop = index // NUM_VARIANTS
+            return next(
+                name
+                for name, entry in self.entries.items()
+                if entry["offset"] <= crop < entry["offset"] + entry["count"]
+            )
+
+    names = [f"img{i:03d}.png" for i in range(40)]
+    dataset = Dataset(names)
+    train, val = split_dataset(dataset)
+    assert len(train.indices) + len(val.indices) == 40 * 2 * NUM_VARIANTS
+    train_images = {dataset.image_of(i) for i in train.indices}
+    val_images = {dataset.image_of(i) for i in val.indices}
+    assert not train_images & val_images
+    assert val_images == {name for name in names if is_val_file(name)}
+
+    # A new annotation moves no other image to the other side
+    bigger = Dataset(names + ["img999.png"])
+    _, bigger_val = split_dataset(bigger)
+    assert val_images <= {bigger.image_of(i) for i in bigger_val.indices}
+    print("✓ test_split_dataset passed")
+
+
+def test_agnostic_nms():
+    """Test that a die scored as two faces comes out as a single box"""
+    from model.dice_pos_model_onnx_inference import DicePosModelOnnxInference
+
+    model = DicePosModelOnnxInference.__new__(DicePosModelOnnxInference)
+    model.conf, model.iou, model.max_det = 0.25, 0.7, 300
+    # (4 + 6 classes, anchors): the same die as a "3" and, a bit lower, a "5",
+    # plus a second die elsewhere
+    pred = np.zeros((10, 3), dtype=np.float32)
+    pred[:4, 0] = [50, 50, 40, 40]
+    pred[:4, 1] = [51, 50, 40, 41]
+    pred[:4, 2] = [150, 100, 40, 40]
+    pred[4 + 2, 0] = 0.6
+    pred[4 + 4, 1] = 0.55
+    pred[4 + 0, 2] = 0.9
+    bboxes, classes, scores = model._to_bboxes(pred, 1.0, (0, 0), (480, 640))
+    assert len(bboxes) == 2
+    assert sorted(classes) == [0, 2]
+    print("✓ test_agnostic_nms passed")
+
+
+def test_detection_cache():
+    """Test the LRU order, TTL expiry, size bound and counters of the cache"""
+    import time
+    from serve.cache import DetectionCache
+
+    frames = [np.full((4, 4, 3), i, dtype=np.uint8) for i in range(4)]
+    cache = DetectionCache(max_entries=2, ttl=60.0)
+    key, result = cache.lookup(frames[0])
+    assert result is None
+    cache.put(key, "a")
+    cache.put(cache.lookup(frames[1])[0], "b")
+    assert cache.lookup(frames[0])[1] == "a"  # 0 is now the most recent
+
+    # A third entry evicts the least recently used one (1, not 0)
+    cache.put(cache.lookup(frames[2])[0], "c")
+    assert cache.lookup(frames[1])[1] is None
+    assert cache.lookup(frames[0])[1] == "a"
+    assert cache.lookup(frames[2])[1] == "c"
+    # A frame differing by one pixel is another entry
+    changed = frames[0].copy()
+    changed[0, 0, 0] = 255
+    assert cache.lookup(changed)[1] is None
+    assert cache.stats() == {
+        "entries": 2,
+        "max_entries": 2,
+        "hits": 3,
+        "misses": 5,
+        "evictions": 1,
+    }
+
+    cache = DetectionCache(max_entries=2, ttl=0.05)
+    cache.put(cache.lookup(frames[3])[0], "d")
+    assert cache.lookup(frames[3])[1] == "d"
+    time.sleep(0.1)
+    assert cache.lookup(frames[3])[1] is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["evictions"] == 1
+    print("✓ test_detection_cache passed")
+
+
+def test_motion_gate():
+    """Test that the stream gate lets one frame through once the dice settle"""
+    import io
+    from PIL import Image
+    from serve.motion import MotionGate, motion_thumbnail
+
+    def encode(pixels):
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    rng = np.random.default_rng(0)
+    scene = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    still = motion_thumbnail(encode(scene), width=64)
+    assert still.shape == (48, 64) and still.dtype == np.float32
+    # Sensor noise stays below the threshold, a moved die does not
+    noisy = np.clip(still + rng.normal(0, 1, still.shape), 0, 255).astype(np.float32)
+    moved = scene.copy()
+    moved[20:100, 30:130] = 255 - moved[20:100, 30:130]
+    moving = motion_thumbnail(encode(moved), width=64)
+
+    gate = MotionGate(threshold=3.0, settle_frames=3)
+    # The first frame has nothing to compare with: moving
+    assert gate.update(still) == (True, False)
+    assert gate.update(noisy) == (False, False)
+    assert gate.update(still) == (False, False)
+    assert gate.update(still) == (False, True)  # settled: detect this one
+    assert gate.update(still) == (False, False)  # only once
+    # A new roll: moving, then detected again after settling
+    assert gate.update(moving) == (True, False)
+    assert gate.update(still) == (True, False)
+    assert [gate.update(still) for _ in range(3)] == [
+        (False, False),
+        (False, False),
+        (False, True),
+    ]
+    # After a failed detection the next still frame goes through again
+    gate.reset()
+    assert gate.update(still) == (False, True)
+    print("✓ test_motion_gate passed")
+
+
+def test_startup_probes():
+    """Test the liveness/readiness probes while loading, once ready and on failure"""
+    import threading
+    import time
+    import api
+    from fastapi.testclient import TestClient
+
+    loading = threading.Event()
+
+    def build_detector():
+        # Stands in for the model load and warm-up
+        loading.wait(5)
+        api.startup["phases"]["load"] = 0.0
+        return StubDetector()
+
+    def failing_detector():
+        raise FileNotFoundError("output/dice-pos-model.pt")
+
+    def wait_for(state):
+        for _ in range(100):
+            if api.startup["state"] == state:
+                return
+            time.sleep(0.05)
+        assert False, f"startup never reached {state}"
+
+    saved = {
+        name: getattr(api, name)
+        for name in ["build_detector", "import_backend", "configure_threads"]
+    }
+    api.import_backend = api.configure_threads = lambda *args: None
+    try:
+        api.build_detector = build_detector
+        with TestClient(api.app) as client:
+            assert client.get("/healthz").json() == {"state": "starting"}
+            response = client.get("/readyz")
+            assert response.status_code == 503
+            assert response.json()["state"] == "starting"
+            assert client.post("/detect", files={"file": b"x"}).status_code == 503
+
+            loading.set()
+            wait_for("ready")
+            assert client.get("/healthz").json() == {"state": "ready"}
+            response = client.get("/readyz")
+            assert response.status_code == 200
+            assert set(response.json()["phases"]) == {"import", "load", "total"}
+
+        api.startup.update(state="starting", phases={}, error=None)
+        api.executor = None
+        api.build_detector = failing_detector
+        api.logger.disabled = True  # the expected traceback
+        with TestClient(api.app) as client:
+            wait_for("failed")
+            response = client.get("/healthz")
+            assert response.status_code == 500
+            assert "dice-pos-model.pt" in response.json()["error"]
+            assert client.get("/readyz").status_code == 503
+    finally:
+        for name, value in saved.items():
+            setattr(api, name, value)
+        api.startup.update(state="starting", phases={}, error=None)
+        api.executor = None
+        api.logger.disabled = False
+    print("✓ test_startup_probes passed")
+
+
+def test_benchmark_compare():
+    """Test that the benchmark flags regressions and runs missing from the baseline"""
+    from utils.benchmark import compare
+
+    def run(stage, threads, batch, p95_ms=10.0, fps=100.0, peak_rss_mb=500.0):
+        return {
+            "stage": stage,
+            "threads": threads,
+            "batch": batch,
+            "p95_ms": p95_ms,
+            "fps": fps,
+            "peak_rss_mb": peak_rss_mb,
+        }
+
+    baseline = {"results": [run("pos", 1, 1), run("pos", 1, 4), run("score", 1, 1)]}
+    # Within the tolerance, and a baseline run left out of this one
+    assert compare([run("pos", 1, 1, 11.5, 85.0, 590.0)], baseline, 0.2) == []
+    regressions = compare(
+        [
+            run("pos", 1, 1, p95_ms=12.5),
+            run("pos", 1, 4, fps=79.0),
+            run("score", 1, 1, peak_rss_mb=601.0),
+            run("crop", 1, 1),
+        ],
+        baseline,
+        0.2,
+    )
+    assert regressions == [
+        "('pos', 1, 1): p95 12.5ms (baseline 10.0ms)",
+        "('pos', 1, 4): 79.0 fps (baseline 100.0 fps)",
+        "('score', 1, 1): peak RSS 601MB (baseline 500MB)",
+        "('crop', 1, 1): not in the baseline",
+    ]
+    print("✓ test_benchmark_compare passed")
+
+
+def test_collate_crops():
+    """Test that a collated batch of every variant goes through both classifiers"""
+    import torch
+    from model.dice_score_dataset import NUM_VARIANTS, collate_crops
+    from model.dice_score_model import DiceScoreModel
+    from model.dice_score_model_tiny import DiceScoreModelTiny
+    from model.preprocess import INPUT_SIZE
+
+    rng = np.random.default_rng(0)
+    batch = [
+        (
+            rng.integers(0, 256, (INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8),
+            i % 6,
+            i % NUM_VARIANTS,
+        )
+        for i in range(8)
+    ]
+    images, labels = collate_crops(batch)
+    assert images.shape == (8, 3, INPUT_SIZE, INPUT_SIZE)
+    assert images.is_contiguous() and labels.tolist() == [i % 6 for i in range(8)]
+    # The variants of one crop are its flips and rotation
+    crop = batch[0][0]
+    images_of_crop, _ = collate_crops([(crop, 0, v) for v in range(4)])
+    original = images_of_crop[0]
+    assert torch.equal(images_of_crop[1], original.flip(1))
+    assert torch.equal(images_of_crop[2], original.flip(2))
+    assert torch.equal(images_of_crop[3], original.rot90(1, dims=(1, 2)))
+    for model in [DiceScoreModel(), DiceScoreModelTiny()]:
+        model.train()
+        outputs = model(images)
+        assert outputs.shape == (8, 6)
+        torch.nn.functional.cross_entropy(outputs, labels).backward()
+    print("✓ test_collate_crops passed")
+
+
+def test_sync_crop_cache():
+    """Test that the crop cache only extracts the changed annotations again"""
+    from model.annotation_store import AnnotationStore
+    from model.data_utils import load_manifest
+    from model.dice_score_dataset import sync_crop_cache
+    from model.preprocess import crop_boxes, load_image
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_dir = os.path.join(tmp, "inputs")
+        target_dir = os.path.join(tmp, "targets")
+        cache_dir = os.path.join(tmp, "crops")
+        os.makedirs(input_dir)
+        rng = np.random.default_rng(0)
+        store = AnnotationStore(os.path.join(tmp, "annotations.db"))
+        for i, name in enumerate(["a.png", "b.png", "c.png", "d.png"]):
+            pixels = rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(os.path.join(input_dir, name))
+            boxes = [(2 + j * 20, 4, 16, 16, (i + j) % 6 + 1) for j in range(i + 1)]
+            store.put(name, boxes, (64, 48))
+
+        def check_cache():
+            # Every manifest slice holds the crops and labels of its image
+            manifest = load_manifest(os.path.join(cache_dir, "manifest.json"))
+            crops = np.load(os.path.join(cache_dir, "crops.npy"))
+            labels = np.load(os.path.join(cache_dir, "labels.npy"))
+            records = store.annotations()
+            offset = 0
+            for name in sorted(manifest):
+                entry = manifest[name]
+                assert entry["offset"] == offset
+                boxes = records[name][1]
+                assert entry["count"] == len(boxes)
+                image = load_image(os.path.join(input_dir, name))
+                expected = crop_boxes(image, [box[:4] for box in boxes])
+                span = slice(offset, offset + entry["count"])
+                assert np.array_equal(crops[span], expected)
+                assert labels[span].tolist() == [pips - 1 for *_, pips in boxes]
+                offset += entry["count"]
+            assert offset == len(crops) == len(labels)
+            return manifest
+
+        assert sync_crop_cache(input_dir, target_dir, cache_dir, 1) == (0, 4, 0)
+        before = check_cache()
+        assert sync_crop_cache(input_dir, target_dir, cache_dir, 1) == (4, 0, 0)
+
+        # b relabelled, c touched with the same content, d removed
+        store.put("b.png", [(10, 10, 20, 20, 5)], (64, 48))
+        c_path = os.path.join(input_dir, "c.png")
+        stat = os.stat(c_path)
+        os.utime(c_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        os.remove(os.path.join(input_dir, "d.png"))
+        assert sync_crop_cache(input_dir, target_dir, cache_dir, 1) == (2, 1, 1)
+        after = check_cache()
+        assert sorted(after) == ["a.png", "b.png", "c.png"]
+        assert after["a.png"] == before["a.png"]
+        assert after["b.png"]["labels"] != before["b.png"]["labels"]
+        # c keeps its crops, only its signature is updated
+        assert after["c.png"]["image"] != before["c.png"]["image"]
+        assert after["c.png"]["image_hash"] == before["c.png"]["image_hash"]
+        assert sync_crop_cache(input_dir, target_dir, cache_dir, 1) == (3, 0, 0)
+        store.close()
+    print("✓ test_sync_crop_cache passed")
+
+
+def test_convert_dataset():
+    """Test that the YOLO dataset only converts the changed annotations again"""
+    import time
+    from model.annotation_store import AnnotationStore
+    from model.data_utils import load_manifest
+    from model.dice_pos_model_train import convert_dataset
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_dir = os.path.join(tmp, "inputs")
+        target_dir = os.path.join(tmp, "targets")
+        dest_dir = os.path.join(tmp, "yolo-data")
+        os.makedirs(input_dir)
+        store = AnnotationStore(os.path.join(tmp, "annotations.db"))
+        for i, name in enumerate(["a.png", "b.png", "c.png", "d.png"]):
+            Image.new("RGB", (64, 48), (i * 60, 0, 0)).save(
+                os.path.join(input_dir, name)
+            )
+            store.put(name, [(0, 0, 16, 16, i + 1)], (64, 48))
+        store.close()
+
+        def converted():
+            # Modification time of the label file of every sample, and no
+            # file that is not in the manifest
+            manifest = load_manifest(os.path.join(dest_dir, "manifest.json"))
+            times = {}
+            for name, entry in manifest.items():
+                image_path = f"{dest_dir}/images/{entry['split']}/{name}"
+                label_path = f"{dest_dir}/labels/{entry['split']}/{name[:-4]}.txt"
+                assert os.path.exists(image_path)
+                times[name] = os.stat(label_path).st_mtime_ns
+            for kind in ["images", "labels"]:
+                for split in ["train", "val"]:
+                    for file in os.listdir(f"{dest_dir}/{kind}/{split}"):
+                        assert os.path.splitext(file)[0] + ".png" in manifest
+            return manifest, times
+
+        assert sum(convert_dataset(input_dir, target_dir, dest_dir, workers=1)) == 4
+        before, times = converted()
+        time.sleep(0.01)
+
+        # b relabelled, c touched with the same content, d removed
+        store = AnnotationStore(os.path.join(tmp, "annotations.db"))
+        store.put("b.png", [(8, 8, 16, 16, 6)], (64, 48))
+        store.close()
+        c_path = os.path.join(input_dir, "c.png")
+        stat = os.stat(c_path)
+        os.utime(c_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        os.remove(os.path.join(input_dir, "d.png"))
+        assert sum(convert_dataset(input_dir, target_dir, dest_dir, workers=1)) == 3
+        after, new_times = converted()
+        assert sorted(after) == ["a.png", "b.png", "c.png"]
+        assert new_times["a.png"] == times["a.png"]
+        assert new_times["b.png"] != times["b.png"]
+        assert new_times["c.png"] == times["c.png"]
+        assert after["c.png"]["image"] != before["c.png"]["image"]
+        with open(f"{dest_dir}/labels/{after['b.png']['split']}/b.txt") as f:
+            assert f.read() == "0 0.250000 0.333333 0.250000 0.333333"
+    print("✓ test_convert_dataset passed")
+
+
+def test_tiny_dice_score_model():
+    """Test that the tiny classifier scores 6 faces with far fewer parameters"""
+    import torch
+    from model.dice_score_model import build_dice_score_model
+    from model.dice_score_model_report import count_flops, count_params, cpu_latency
+
+    base, tiny = build_dice_score_model("base"), build_dice_score_model("tiny")
+    tiny.eval()
+    with torch.no_grad():
+        outputs = tiny(torch.rand(5, 3, INPUT_SIZE, INPUT_SIZE))
+    assert outputs.shape == (5, 6)
+    assert count_params(tiny) < count_params(base) / 10
+    assert count_flops(tiny) < count_flops(base)
+    assert cpu_latency(tiny, batch_size=2, runs=3) > 0
+    try:
+        build_dice_score_model("huge")
+        assert False, "an unknown architecture must raise"
+    except Exception as e:
+        assert "huge" in str(e)
+    print("✓ test_tiny_dice_score_model passed")
+
+
+def test_project_dataset_from_store():
+    """Test that the classifier trains from the store alone, any image case"""
+    from model.annotation_store import AnnotationStore
+    from model.data_utils import list_images
+    from model.dice_score_dataset import NUM_VARIANTS, ProjectDataset
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_dir = os.path.join(tmp, "inputs")
+        target_dir = os.path.join(tmp, "targets")
+        os.makedirs(input_dir)
+        os.makedirs(target_dir)
+        for name in ["A.JPG", "b.png", "c.Png"]:
+            Image.new("RGB", (64, 48), "white").save(os.path.join(input_dir, name))
+        open(os.path.join(input_dir, "notes.txt"), "w").close()
+        assert list_images(input_dir) == ["A.JPG", "b.png", "c.Png"]
+
+        store = AnnotationStore(os.path.join(tmp, "annotations.db"))
+        try:
+            ProjectDataset(input_dir, target_dir, os.path.join(tmp, "crops"))
+            assert False, "no annotation must raise"
+        except Exception as e:
+            assert "No annotated image" in str(e)
+        store.put("A.JPG", [(0, 0, 20, 20, 1), (30, 10, 20, 20, 4)], (64, 48))
+        store.put("c.Png", [(10, 10, 20, 20, 6)], (64, 48))
+        store.close()
+
+        # Empty target folder, the store holds every annotation
+        dataset = ProjectDataset(
+            input_dir, target_dir, os.path.join(tmp, "crops"), workers=1
+        )
+        assert len(dataset) == 3 * NUM_VARIANTS
+        assert sorted(dataset.entries) == ["A.JPG", "c.Png"]
+    print("✓ test_project_dataset_from_store passed")
+
+
+def test_dice_pos_model_onnx_parity():
+    """Test that the onnx backend finds the same boxes as the torch backend"""
+    model_path = "output/dice-pos-model.pt"
+    if not os.path.exists(model_path):
+        print(f"- test_dice_pos_model_onnx_parity skipped ({model_path} not found)")
+        return
+
+    from model.dice_pos_model_inference import DicePosModelInference
+    from model.dice_pos_model_onnx_inference import DicePosModelOnnxInference
+    from model.export_onnx import export_dice_pos_model
+    from model.preprocess import load_image
+
+    input_dir = "data/inputs"
+    image_files = sorted(os.listdir(input_dir)) if os.path.isdir(input_dir) else []
+    frames = [load_image(os.path.join(input_dir, f)) for f in image_files[:8]]
+    if not frames:
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        onnx_path = export_dice_pos_model(
+            model_path, os.path.join(tmp, "dice-pos-model.onnx")
+        )
+        torch_bboxes = DicePosModelInference(model_path).batch(frames)
+        onnx_bboxes = DicePosModelOnnxInference(onnx_path).batch(frames)
+
+    # Resizing differs slightly between the two paths, boxes must still overlap
+    for expected, actual in zip(torch_bboxes, onnx_bboxes):
+        assert abs(len(expected) - len(actual)) <= 1
+        matched = [max((iou(e, a) for a in actual), default=0) > 0.9 for e in expected]
+        assert sum(matched) >= len(expected) - 1
+
+    print("✓ test_dice_pos_model_onnx_parity passed")
+
+
+def run_all_tests():
+    """Run all test functions"""
+    print("Running AI tests...\n")
+
+    try:
+        test_dice_score_model_onnx_parity()
+        test_crop_boxes()
+        test_score_frame()
+        test_tray_roi()
+        test_preload_models()
+        test_core_sets()
+        test_weights_file()
+        test_dice_pos_weights()
+        test_finetune_indices()
+        test_pareto_front()
+        test_pip_counter()
+        test_executor_queue()
+        test_executor_batching()
+        test_request_timing()
+        test_quantize_accept()
+        test_split_dataset()
+        test_agnostic_nms()
+        test_detection_cache()
+        test_motion_gate()
+        test_startup_probes()
+        test_benchmark_compare()
+        test_collate_crops()
+        test_sync_crop_cache()
+        test_convert_dataset()
+        test_tiny_dice_score_model()
+        test_project_dataset_from_store()
+        test_dice_pos_model_onnx_parity()
+
+        print("\n✅ All tests passed!")
+
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        import traceback
+
+        traceback.print_exc()
+        raise
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,364 @@
+from concurrent.futures import ProcessPoolExecutor
+from model.annotation_store import list_annotations
+from model.backends import default_model_paths
+from model.data_utils import split_files
+from model.preprocess import load_image
+from utils.evaluate import score_frame, summarize
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import os
+import platform
+import threading
+import time
+
+
+# Quality of a setting: share of the frames where every die is found with the
+# right score
+ACCURACY_KEY = "roll_accuracy"
+
+# Among settings of equal speed and accuracy, the confidence closest to this
+DEFAULT_CONF = 0.25
+
+
+def measure_accuracy(backend, paths, score_arch, imgsz, confs, samples, iou):
+    # Runs in a fresh process: {conf: metrics} of one input size over the
+    # labelled frames. Threads do not change the results, one is enough
+    from detector import Detector
+    from model.backends import configure_threads
+
+    configure_threads(backend, 1, 1)
+    frames = [(load_image(image_path), labels) for image_path, labels in samples]
+    results = {}
+    for conf in confs:
+        detector = Detector(
+            *paths, backend=backend, score_arch=score_arch, imgsz=imgsz, conf=conf
+        )
+        scored = []
+        for start in range(0, len(frames), 8):
+            chunk = frames[start : start + 8]
+            detections = detector.detect_many([frame for frame, _ in chunk])
+            for (bboxes, scores), (_, labels) in zip(detections, chunk):
+                scored.append(
+                    {**score_frame(bboxes, scores, labels, iou), "timings": {}}
+                )
+        results[conf] = summarize(scored)[0]
+    return results
+
+
+def measure_latency(
+    backend,
+    paths,
+    score_arch,
+    workers,
+    intra_op,
+    inter_op,
+    imgsz_values,
+    batch_sizes,
+    frames,
+    iterations,
+):
+    # Runs in a fresh process, the thread counts only apply before the first
+    # inference. Like the inference executor, `workers` threads each run their
+    # own Detector at the same time, so the cores are shared as in the service.
+    # The confidence threshold barely changes the latency, the default one is
+    # timed
+    from detector import Detector
+    from model.backends import configure_threads
+
+    configure_threads(backend, intra_op, inter_op)
+    results = []
+    for imgsz in imgsz_values:
+        detectors = [
+            Detector(*paths, backend=backend, score_arch=score_arch, imgsz=imgsz)
+            for _ in range(workers)
+        ]
+        for batch_size in batch_sizes:
+            batches = [
+                [frames[(i * batch_size + j) % len(frames)] for j in range(batch_size)]
+                for i in range(iterations)
+            ]
+            for detector in detectors:
+                detector.detect_many(batches[0])  # warm-up
+            latencies = []
+
+            def run(detector):
+                for batch in batches:
+                    started_at = time.perf_counter()
+                    detector.detect_many(batch)
+                    latencies.append((time.perf_counter() - started_at) * 1000)
+
+            threads = [
+                threading.Thread(target=run, args=(detector,)) for detector in detectors
+            ]
+            started_at = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started_at
+            results.append(
+                {
+                    "imgsz": imgsz,
+                    "workers": workers,
+                    "intra_op_threads": intra_op,
+                    "inter_op_threads": inter_op,
+                    "batch_max": batch_size,
+                    # A request waits for its whole batch: the latency of a
+                    # request is the one of its batch, all workers busy
+                    "latency_p50_ms": float(np.percentile(latencies, 50)),
+                    "latency_p95_ms": float(np.percentile(latencies, 95)),
+                    "fps": workers * iterations * batch_size / elapsed,
+                }
+            )
+    return results
+
+
+def pareto_front(candidates):
+    # The candidates no other one beats on both request latency and accuracy,
+    # fastest first. Among equal ones, the highest throughput
+    front = []
+    ordered = sorted(
+        candidates,
+        key=lambda c: (
+            c["latency_p95_ms"],
+            -c["accuracy"],
+            -c["fps"],
+            abs(c["conf"] - DEFAULT_CONF),
+        ),
+    )
+    for candidate in ordered:
+        if not front or candidate["accuracy"] > front[-1]["accuracy"]:
+            front.append(candidate)
+    return front
+
+
+def choose(front, max_drop):
+    # The fastest setting within `max_drop` points of the best accuracy
+    best = max(candidate["accuracy"] for candidate in front)
+    return next(c for c in front if c["accuracy"] >= best - max_drop)
+
+
+def print_front(front, chosen):
+    print(
+        f"{'imgsz':>6}{'conf':>7}{'workers':>9}{'intra':>7}{'inter':>7}{'batch':>7}"
+        f"{'p95 ms':>9}{'fps':>8}{'accuracy':>10}"
+    )
+    for c in front:
+        marker = "  <-" if c is chosen else ""
+        print(
+            f"{c['imgsz']:>6}{c['conf']:>7.2f}{c['workers']:>9}"
+            f"{c['intra_op_threads']:>7}{c['inter_op_threads']:>7}{c['batch_max']:>7}"
+            f"{c['latency_p95_ms']:>9.2f}{c['fps']:>8.1f}{c['accuracy']:>9.2f}%{marker}"
+        )
+
+
+def default_threads():
+    # 1, 2, 4, ... up to the number of cores
+    cores = os.cpu_count() or 1
+    threads = [1]
+    while threads[-1] * 2 <= cores:
+        threads.append(threads[-1] * 2)
+    return threads + ([cores] if threads[-1] != cores else [])
+
+
+if __name__ == "__main__":
+    # How to run (from `ai`): python -m utils.autotune --output profiles/pi.json
+    # then run the service with AI_PROFILE=profiles/pi.json
+    parser = argparse.ArgumentParser(description="Tune the detector for this machine")
+    parser.add_argument("--backend", default="torch")
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--score-arch", default="base")
+    parser.add_argument("--pos-model")
+    parser.add_argument("--score-model")
+    parser.add_argument("--imgsz", nargs="+", type=int, default=[192, 256, 320, 416])
+    parser.add_argument("--conf", nargs="+", type=float, default=[0.1, 0.25, 0.4, 0.55])
+    parser.add_argument(
+        "--serve-workers",
+        nargs="+",
+        type=int,
+        default=default_threads(),
+        help="inference executor workers (AI_WORKERS) to try",
+    )
+    parser.add_argument(
+        "--threads",
+        nargs="+",
+        type=int,
+        default=default_threads(),
+        help="intra-op threads per worker to try, workers x threads <= cores",
+    )
+    parser.add_argument("--inter-op-threads", nargs="+", type=int, default=[1])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument(
+        "--max-latency-ms",
+        type=float,
+        default=None,
+        help="only settings whose p95 request latency stays below this",
+    )
+    parser.add_argument(
+        "--max-drop",
+        type=float,
+        default=0.5,
+        help="accuracy points traded for speed against the most accurate setting",
+    )
+    parser.add_argument("--inputs", default="data/inputs")
+    parser.add_argument("--targets", default="data/targets")
+    parser.add_argument("--split", choices=["all", "val"], default="val")
+    parser.add_argument("--limit", type=int, default=100, help="0 uses all")
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="processes measuring the accuracy",
+    )
+    parser.add_argument("--output", default=f"profiles/{platform.node()}.json")
+    args = parser.parse_args()
+
+    annotations = list_annotations(args.inputs, args.targets)
+    samples = {name: (path, labels) for name, path, _, labels in annotations}
+    image_files = list(samples)
+    if args.split == "val":
+        _, image_files = split_files(image_files)
+    if args.limit:
+        image_files = image_files[: args.limit]
+    if not image_files:
+        raise Exception("[-- ERROR --] No annotated frames to tune on.")
+    samples = [samples[image_file] for image_file in image_files]
+
+    pos_path, score_path = default_model_paths(
+        args.backend, args.precision, score_arch=args.score_arch
+    )
+    paths = (args.pos_model or pos_path, args.score_model or score_path)
+    context = multiprocessing.get_context("spawn")
+
+    # Accuracy of every (imgsz, conf), one fresh process per input size
+    print(f"[-- INFO --] Accuracy of {len(args.imgsz) * len(args.conf)} settings")
+    with ProcessPoolExecutor(
+        max_workers=min(args.jobs, len(args.imgsz)),
+        mp_context=context,
+        max_tasks_per_child=1,
+    ) as pool:
+        jobs = [
+            pool.submit(
+                measure_accuracy,
+                args.backend,
+                paths,
+                args.score_arch,
+                imgsz,
+                args.conf,
+                samples,
+                args.iou,
+            )
+            for imgsz in args.imgsz
+        ]
+        accuracy = {
+            (imgsz, conf): metrics
+            for imgsz, job in zip(args.imgsz, jobs)
+            for conf, metrics in job.result().items()
+        }
+
+    # Latency of every (workers, threads, imgsz, batch), one process at a time
+    # so that the runs do not compete for the cores. The workers never get
+    # more threads than there are cores between them
+    cores = os.cpu_count() or 1
+    layouts = [
+        (workers, intra_op, inter_op)
+        for workers in args.serve_workers
+        for intra_op in args.threads
+        for inter_op in args.inter_op_threads
+        if workers * intra_op <= cores
+    ]
+    if not layouts:
+        raise Exception(f"[-- ERROR --] No workers x threads fits in {cores} cores.")
+    print(
+        f"[-- INFO --] Latency of {len(layouts) * len(args.imgsz)} "
+        f"worker/thread/input size settings"
+    )
+    frames = [load_image(image_path) for image_path, _ in samples[:8]]
+    latency = []
+    for workers, intra_op, inter_op in layouts:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            latency.extend(
+                pool.submit(
+                    measure_latency,
+                    args.backend,
+                    paths,
+                    args.score_arch,
+                    workers,
+                    intra_op,
+                    inter_op,
+                    args.imgsz,
+                    args.batch_sizes,
+                    frames,
+                    args.iterations,
+                ).result()
+            )
+
+    candidates = [
+        {
+            **timing,
+            "conf": conf,
+            "accuracy": accuracy[(timing["imgsz"], conf)][ACCURACY_KEY],
+            "recall": accuracy[(timing["imgsz"], conf)]["recall"],
+            "precision": accuracy[(timing["imgsz"], conf)]["precision"],
+        }
+        for timing in latency
+        for conf in args.conf
+        if args.max_latency_ms is None
+        or timing["latency_p95_ms"] <= args.max_latency_ms
+    ]
+    if not candidates:
+        raise Exception("[-- ERROR --] No setting meets the latency budget.")
+    front = pareto_front(candidates)
+    chosen = choose(front, args.max_drop)
+    print()
+    print_front(front, chosen)
+
+    profile = {
+        "meta": {
+            "backend": args.backend,
+            "precision": args.precision,
+            "score_arch": args.score_arch,
+            "models": paths,
+            "frames": len(samples),
+            "split": args.split,
+            "max_drop": args.max_drop,
+            "max_latency_ms": args.max_latency_ms,
+            "cpu_count": os.cpu_count(),
+            "machine": platform.machine(),
+            "node": platform.node(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        # Read by config.py (AI_PROFILE)
+        "settings": {
+            key: chosen[key]
+            for key in [
+                "imgsz",
+                "conf",
+                "workers",
+                "intra_op_threads",
+                "inter_op_threads",
+                "batch_max",
+            ]
+        },
+        "expected": {
+            key: chosen[key]
+            for key in [
+                "latency_p95_ms",
+                "fps",
+                "accuracy",
+                "recall",
+                "precision",
+            ]
+        },
+        "pareto": front,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(
+        f"\n[-- SUCCESS --] Profile saved to {args.output}, run with AI_PROFILE={args.output}"
+    )
@@ -0,0 +1,244 @@
+from concurrent.futures import ProcessPoolExecutor
+from model.backends import default_model_paths
+from model.data_utils import list_images
+from model.preprocess import crop_boxes, load_image
+from PIL import Image, ImageDraw
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import os
+import platform
+import resource
+import sys
+import time
+
+
+STAGES = ["detector", "pos", "score"]
+
+PIP_LAYOUT = {
+    1: [(0.5, 0.5)],
+    2: [(0.25, 0.25), (0.75, 0.75)],
+    3: [(0.25, 0.25), (0.5, 0.5), (0.75, 0.75)],
+    4: [(0.25, 0.25), (0.75, 0.25), (0.25, 0.75), (0.75, 0.75)],
+    5: [(0.25, 0.25), (0.75, 0.25), (0.5, 0.5), (0.25, 0.75), (0.75, 0.75)],
+    6: [(0.25, 0.2), (0.75, 0.2), (0.25, 0.5), (0.75, 0.5), (0.25, 0.8), (0.75, 0.8)],
+}
+
+
+def synthetic_frames(count=8, size=(640, 480), seed=0):
+    # Two white dice on a green table per frame, the same for every run
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        img = Image.new("RGB", size, (30, 110, 40))
+        draw = ImageDraw.Draw(img)
+        for i in range(2):
+            side = int(rng.integers(50, 80))
+            x = int(rng.integers(20, size[0] // 2 - side)) + i * size[0] // 2
+            y = int(rng.integers(20, size[1] - side - 20))
+            draw.rectangle([x, y, x + side, y + side], fill=(240, 240, 240))
+            for px, py in PIP_LAYOUT[int(rng.integers(1, 7))]:
+                r = side * 0.08
+                cx, cy = x + px * side, y + py * side
+                draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=(10, 10, 10))
+        frames.append(np.asarray(img))
+    return frames
+
+
+def load_frames(frames_dir, count):
+    if frames_dir and os.path.isdir(frames_dir) and list_images(frames_dir):
+        files = list_images(frames_dir)[:count]
+        return [load_image(os.path.join(frames_dir, f)) for f in files], frames_dir
+    return synthetic_frames(count), "synthetic"
+
+
+def percentile(values, q):
+    return float(np.percentile(np.array(values) * 1000, q))
+
+
+def run_stage(stage, backend, threads, batch_sizes, iterations, frames, paths):
+    # Runs in a fresh process: thread settings apply cleanly and the peak RSS
+    # only covers this stage
+    from detector import Detector
+    from model.backends import (
+        configure_threads,
+        load_dice_pos_model,
+        load_dice_score_model,
+    )
+
+    configure_threads(backend, threads, 1)
+    pos_path, score_path = paths
+
+    if stage == "detector":
+        model = Detector(pos_path, score_path, backend=backend)
+        inputs = frames
+        run = model.detect_many
+    elif stage == "pos":
+        model = load_dice_pos_model(pos_path, backend)
+        inputs = frames
+        run = model.batch
+    else:
+        model = load_dice_score_model(score_path, backend)
+        rng = np.random.default_rng(0)
+        inputs = []
+        for frame in frames:
+            h, w = frame.shape[:2]
+            for _ in range(4):
+                side = int(rng.integers(40, 90))
+                x, y = int(rng.integers(0, w - side)), int(rng.integers(0, h - side))
+                inputs.extend(crop_boxes(frame, [(x, y, side, side)]))
+        run = lambda batch: model.classify(np.stack(batch))  # noqa: E731
+
+    results = []
+    for batch_size in batch_sizes:
+        batches = [
+            [inputs[(i * batch_size + j) % len(inputs)] for j in range(batch_size)]
+            for i in range(iterations)
+        ]
+        run(batches[0])  # warm-up
+        latencies = []
+        started_at = time.perf_counter()
+        for batch in batches:
+            t = time.perf_counter()
+            run(batch)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - started_at
+
+        fps = iterations * batch_size / elapsed
+        results.append(
+            {
+                "stage": stage,
+                "threads": threads,
+                "batch": batch_size,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "fps": fps,
+                "fps_per_core": fps / threads,
+            }
+        )
+
+    # ru_maxrss is in KiB on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    for result in results:
+        result["peak_rss_mb"] = peak_rss_mb
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # A run regresses when its p95 latency or peak RSS grows, or its throughput
+    # drops, by more than `tolerance` (relative) compared to the same
+    # stage/threads/batch. A run the baseline does not have (a renamed stage, a
+    # changed matrix) is a failure too: it would otherwise pass unchecked
+    def key(r):
+        return (r["stage"], r["threads"], r["batch"])
+
+    reference = {key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = reference.get(key(result))
+        if base is None:
+            regressions.append(f"{key(result)}: not in the baseline")
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{key(result)}: p95 {result['p95_ms']:.1f}ms "
+                f"(baseline {base['p95_ms']:.1f}ms)"
+            )
+        if result["fps"] < base["fps"] * (1 - tolerance):
+            regressions.append(
+                f"{key(result)}: {result['fps']:.1f} fps "
+                f"(baseline {base['fps']:.1f} fps)"
+            )
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(
+                f"{key(result)}: peak RSS {result['peak_rss_mb']:.0f}MB "
+                f"(baseline {base['peak_rss_mb']:.0f}MB)"
+            )
+    return regressions
+
+
+def print_table(results):
+    print(
+        f"{'stage':<10}{'threads':>8}{'batch':>7}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'p99 ms':>10}{'fps':>9}{'fps/core':>10}{'RSS MB':>9}"
+    )
+    for r in results:
+        print(
+            f"{r['stage']:<10}{r['threads']:>8}{r['batch']:>7}{r['p50_ms']:>10.2f}"
+            f"{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['fps']:>9.1f}"
+            f"{r['fps_per_core']:>10.1f}{r['peak_rss_mb']:>9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    # How to run (from `ai`): python -m utils.benchmark
+    parser = argparse.ArgumentParser(description="Detector latency benchmark")
+    parser.add_argument("--backend", default="torch")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--frames", default="data/inputs")
+    parser.add_argument("--frame-count", type=int, default=8)
+    parser.add_argument("--pos-model")
+    parser.add_argument("--score-model")
+    parser.add_argument("--output", default="var/benchmark.json")
+    parser.add_argument("--baseline", help="fail on regressions against this file")
+    parser.add_argument("--save-baseline", help="also write the results here")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    frames, source = load_frames(args.frames, args.frame_count)
+    pos_path, score_path = default_model_paths(args.backend)
+    paths = (args.pos_model or pos_path, args.score_model or score_path)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for stage in args.stages:
+        for threads in args.threads:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results.extend(
+                    pool.submit(
+                        run_stage,
+                        stage,
+                        args.backend,
+                        threads,
+                        args.batch_sizes,
+                        args.iterations,
+                        frames,
+                        paths,
+                    ).result()
+                )
+
+    report = {
+        "meta": {
+            "backend": args.backend,
+            "frames": source,
+            "frame_count": len(frames),
+            "iterations": args.iterations,
+            "cpu_count": os.cpu_count(),
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    print_table(results)
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[-- INFO --] Results saved to {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("[-- ERROR --] Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("[-- SUCCESS --] No regression against the baseline")
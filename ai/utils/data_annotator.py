@@ -1,5 +1,7 @@
 import tkinter as tk
 from tkinter import messagebox, simpledialog
+from model.annotation_store import open_store
+from model.data_utils import list_images
 from PIL import Image, ImageTk
 import os
 
@@ -16,6 +18,11 @@ class DiceAnnotator:
         os.makedirs(self.input_dir, exist_ok=True)
         os.makedirs(self.target_dir, exist_ok=True)
 
+        # Annotations are kept in data/annotations.db (the txt files of
+        # `target_dir` are imported the first time)
+        self.store = open_store(self.input_dir, self.target_dir)
+        self.annotated = self.store.annotated_names()
+
         # GUI elements
         self.listbox = tk.Listbox(root, width=50)
         self.listbox.pack(side=tk.LEFT, fill=tk.Y)
@@ -48,11 +55,7 @@ class DiceAnnotator:
     def load_images(self):
         self.listbox.delete(0, tk.END)  # Clear the listbox
         if os.path.exists(self.input_dir):
-            images = []
-            for f in os.listdir(self.input_dir):
-                if f.lower().endswith((".png", ".jpg", ".jpeg")):
-                    is_annotated = self.is_annotated(f)
-                    images.append((f, is_annotated))
+            images = [(f, self.is_annotated(f)) for f in list_images(self.input_dir)]
 
             # Sort: not annotated first, then annotated, then by name
             images.sort(key=lambda x: (x[1], x[0]))  # x[1] is bool, False < True
@@ -62,8 +65,7 @@ class DiceAnnotator:
                 self.listbox.insert(tk.END, f"{img} - {status}")
 
     def is_annotated(self, img_name):
-        base = os.path.splitext(img_name)[0]
-        return os.path.exists(os.path.join(self.target_dir, base + ".txt"))
+        return img_name in self.annotated
 
     def on_image_select(self, _):
         selection = self.listbox.curselection()
@@ -147,21 +149,7 @@ class DiceAnnotator:
 
     def load_and_draw_annotations(self, img_name):
         if self.is_annotated(img_name):
-            base = os.path.splitext(img_name)[0]
-            label_path = os.path.join(self.target_dir, base + ".txt")
-            with open(label_path, "r") as f:
-                self.annotations = []
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) == 5:
-                        x, y, w, h, pips = (
-                            int(parts[0]),
-                            int(parts[1]),
-                            int(parts[2]),
-                            int(parts[3]),
-                            int(parts[4]),
-                        )
-                        self.annotations.append((x, y, w, h, pips))
+            self.annotations = self.store.get(img_name)
             self.draw_annotations()
         else:
             self.annotations = []
@@ -187,15 +175,14 @@ class DiceAnnotator:
         if not self.annotations:
             messagebox.showerror("Error", "No annotation to save")
             return
-        base = os.path.splitext(os.path.basename(self.current_image_path))[0]  # type: ignore
-        label_path = os.path.join(self.target_dir, base + ".txt")
-        with open(label_path, "w") as f:
-            for x, y, w, h, pips in self.annotations:
-                f.write(f"{x} {y} {w} {h} {pips}\n")
+        img_name = os.path.basename(self.current_image_path)  # type: ignore
+        self.store.put(img_name, self.annotations, self.image.size)
+        self.annotated.add(img_name)
         self.load_images()
 
 
 if __name__ == "__main__":
+    # How to run (from `ai`): python -m utils.data_annotator
     root = tk.Tk()
     app = DiceAnnotator(root)
     root.mainloop()
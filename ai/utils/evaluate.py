@@ -0,0 +1,289 @@
+from concurrent.futures import ProcessPoolExecutor
+from model.annotation_store import list_annotations
+from model.backends import default_model_paths
+from model.data_utils import split_files
+from model.metrics import match_boxes
+from model.preprocess import crop_boxes, load_image
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import os
+import platform
+import time
+
+
+# "cnn_score": crop + score of the CNN-only path, next to "pips" + "crop" +
+# "score" of the cascade
+STAGES = ["decode", "pos", "pips", "crop", "score", "cnn_score", "total"]
+
+# Detector of the worker process, built once by `init_worker`
+_detector = None
+
+
+def init_worker(
+    backend, threads, paths, single_stage, score_arch, imgsz, conf, fast_path_conf
+):
+    global _detector
+    from detector import Detector
+    from model.backends import configure_threads
+
+    configure_threads(backend, threads, 1)
+    _detector = Detector(
+        *paths,
+        backend=backend,
+        single_stage=single_stage,
+        score_arch=score_arch,
+        imgsz=imgsz,
+        conf=conf,
+        fast_path_conf=fast_path_conf,
+    )
+    _detector.warmup()
+
+
+def score_frame(bboxes, scores, labels, threshold=0.5):
+    # Detection and pip counts of one frame against its `x y w h pips` labels
+    matches = match_boxes(bboxes, labels, threshold)
+    pips_correct = sum(scores[i] == labels[j][4] for i, j in matches)
+    return {
+        "tp": len(matches),
+        "fp": len(bboxes) - len(matches),
+        "fn": len(labels) - len(matches),
+        "pips_correct": pips_correct,
+        # Every die found, no extra box and every score right
+        "roll_correct": len(matches) == len(labels) == len(bboxes)
+        and pips_correct == len(matches),
+    }
+
+
+def score_cascade(bboxes, scores, fast, cnn_scores, labels, threshold=0.5):
+    # Pip counts of the cascade (`fast`: box scored by the pip counter) against
+    # the labels and the CNN-only scores of the same boxes
+    matches = match_boxes(bboxes, labels, threshold)
+    cnn_pips_correct = sum(cnn_scores[i] == labels[j][4] for i, j in matches)
+    return {
+        "fast_path": sum(fast),
+        "fast_matched": sum(fast[i] for i, _ in matches),
+        "fast_correct": sum(fast[i] and scores[i] == labels[j][4] for i, j in matches),
+        "cnn_pips_correct": cnn_pips_correct,
+        "cnn_roll_correct": len(matches) == len(labels) == len(bboxes)
+        and cnn_pips_correct == len(matches),
+        "agree": sum(a == b for a, b in zip(scores, cnn_scores)),
+    }
+
+
+def evaluate_chunk(samples, threshold):
+    # Runs in a worker process: [(image_path, labels)] -> per-frame results
+    results = []
+    for image_path, labels in samples:
+        cascade = []
+        started_at = time.perf_counter()
+        frame = load_image(image_path)
+        timings = {"decode": time.perf_counter() - started_at}
+        bboxes, scores = _detector.detect_many(  # type: ignore
+            [frame], timings, cascade=cascade
+        )[0]
+        timings["total"] = time.perf_counter() - started_at
+        result = {
+            "image": os.path.basename(image_path),
+            **score_frame(bboxes, scores, labels, threshold),
+        }
+        if _detector.fast_path_conf is not None and _detector.dice_score_model:
+            # CNN-only path on the same frame and boxes: every die classified
+            # by the dice score model
+            cnn_started_at = time.perf_counter()
+            crops = crop_boxes(frame, bboxes)
+            cnn_scores, _ = _detector.dice_score_model.classify(crops)
+            timings["cnn_score"] = time.perf_counter() - cnn_started_at
+            result.update(
+                score_cascade(bboxes, scores, cascade[0], cnn_scores, labels, threshold)
+            )
+        results.append({**result, "timings": timings})
+    return results
+
+
+def summarize(frames):
+    tp = sum(frame["tp"] for frame in frames)
+    fp = sum(frame["fp"] for frame in frames)
+    fn = sum(frame["fn"] for frame in frames)
+    pips_correct = sum(frame["pips_correct"] for frame in frames)
+    metrics = {
+        "frames": len(frames),
+        "dice": tp + fn,
+        "precision": 100 * tp / (tp + fp) if tp + fp else 0.0,
+        "recall": 100 * tp / (tp + fn) if tp + fn else 0.0,
+        # Among the dice that were found
+        "pip_accuracy": 100 * pips_correct / tp if tp else 0.0,
+        "roll_accuracy": 100 * np.mean([frame["roll_correct"] for frame in frames]),
+    }
+    if frames and "fast_path" in frames[0]:
+        # Cascade: share of the boxes the pip counter scored, its accuracy on
+        # them, and the CNN-only path on the same boxes
+        fast_path = sum(frame["fast_path"] for frame in frames)
+        fast_matched = sum(frame["fast_matched"] for frame in frames)
+        fast_correct = sum(frame["fast_correct"] for frame in frames)
+        cnn_pips_correct = sum(frame["cnn_pips_correct"] for frame in frames)
+        agree = sum(frame["agree"] for frame in frames)
+        metrics.update(
+            {
+                "fast_path_rate": 100 * fast_path / (tp + fp) if tp + fp else 0.0,
+                "fast_path_accuracy": (
+                    100 * fast_correct / fast_matched if fast_matched else 0.0
+                ),
+                "cnn_pip_accuracy": 100 * cnn_pips_correct / tp if tp else 0.0,
+                "cnn_roll_accuracy": 100
+                * np.mean([frame["cnn_roll_correct"] for frame in frames]),
+                "cnn_agreement": 100 * agree / (tp + fp) if tp + fp else 0.0,
+            }
+        )
+
+    latency = {}
+    for stage in STAGES:
+        values = [
+            frame["timings"][stage] * 1000
+            for frame in frames
+            if stage in frame["timings"]
+        ]
+        if values:
+            latency[stage] = {
+                "mean_ms": float(np.mean(values)),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "p99_ms": float(np.percentile(values, 99)),
+            }
+    return metrics, latency
+
+
+def print_report(metrics, latency):
+    print(
+        f"Frames: {metrics['frames']}, dice: {metrics['dice']}\n"
+        f"Precision: {metrics['precision']:.2f}%  Recall: {metrics['recall']:.2f}%\n"
+        f"Pip accuracy: {metrics['pip_accuracy']:.2f}%  "
+        f"Full-roll accuracy: {metrics['roll_accuracy']:.2f}%\n"
+    )
+    if "fast_path_rate" in metrics:
+        print(
+            f"Fast path: {metrics['fast_path_rate']:.2f}% of the dice, "
+            f"{metrics['fast_path_accuracy']:.2f}% correct\n"
+            f"CNN only: pip accuracy {metrics['cnn_pip_accuracy']:.2f}%  "
+            f"full-roll accuracy {metrics['cnn_roll_accuracy']:.2f}%  "
+            f"agreement with the cascade {metrics['cnn_agreement']:.2f}%\n"
+        )
+    print(f"{'stage':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, r in latency.items():
+        print(
+            f"{stage:<10}{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}"
+            f"{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    # How to run (from `ai`): python -m utils.evaluate
+    parser = argparse.ArgumentParser(description="End-to-end detector evaluation")
+    parser.add_argument("--backend", default="torch")
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--single-stage", action="store_true")
+    parser.add_argument("--score-arch", default="base")
+    parser.add_argument(
+        "--weights-format", choices=["pickle", "safetensors"], default="pickle"
+    )
+    parser.add_argument("--imgsz", type=int, default=256)
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument(
+        "--fast-path-conf",
+        type=float,
+        default=None,
+        help="cascade: also reports the pip counter against the CNN-only path",
+    )
+    parser.add_argument("--pos-model")
+    parser.add_argument("--score-model")
+    parser.add_argument("--inputs", default="data/inputs")
+    parser.add_argument("--targets", default="data/targets")
+    parser.add_argument("--split", choices=["all", "val"], default="all")
+    parser.add_argument("--limit", type=int, default=0, help="0 evaluates all")
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=1, help="per worker")
+    parser.add_argument("--chunk-size", type=int, default=16)
+    parser.add_argument("--output", default="var/evaluation.json")
+    args = parser.parse_args()
+
+    samples = {
+        image_file: (image_path, labels)
+        for image_file, image_path, _, labels in list_annotations(
+            args.inputs, args.targets
+        )
+    }
+    image_files = list(samples)
+    if args.split == "val":
+        _, image_files = split_files(image_files)
+    if args.limit:
+        image_files = image_files[: args.limit]
+    if not image_files:
+        raise Exception("[-- ERROR --] No annotated frames to evaluate.")
+
+    pos_path, score_path = default_model_paths(
+        args.backend,
+        args.precision,
+        args.single_stage,
+        args.score_arch,
+        args.weights_format,
+    )
+    paths = (args.pos_model or pos_path, args.score_model or score_path)
+
+    chunks = [
+        [samples[image_file] for image_file in image_files[i : i + args.chunk_size]]
+        for i in range(0, len(image_files), args.chunk_size)
+    ]
+    started_at = time.perf_counter()
+    frames = []
+    with ProcessPoolExecutor(
+        max_workers=min(args.workers, len(chunks)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(
+            args.backend,
+            args.threads,
+            paths,
+            args.single_stage,
+            args.score_arch,
+            args.imgsz,
+            args.conf,
+            args.fast_path_conf,
+        ),
+    ) as pool:
+        for results in pool.map(evaluate_chunk, chunks, [args.iou] * len(chunks)):
+            frames.extend(results)
+    elapsed = time.perf_counter() - started_at
+
+    metrics, latency = summarize(frames)
+    print_report(metrics, latency)
+    print(f"\n[-- INFO --] {len(frames)} frames in {elapsed:.1f}s")
+
+    report = {
+        "meta": {
+            "backend": args.backend,
+            "precision": args.precision,
+            "single_stage": args.single_stage,
+            "score_arch": args.score_arch,
+            "imgsz": args.imgsz,
+            "conf": args.conf,
+            "fast_path_conf": args.fast_path_conf,
+            "weights_format": args.weights_format,
+            "models": paths,
+            "split": args.split,
+            "iou": args.iou,
+            "workers": args.workers,
+            "threads": args.threads,
+            "cpu_count": os.cpu_count(),
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "metrics": metrics,
+        "latency": latency,
+        "frames": frames,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[-- INFO --] Results saved to {args.output}")